@@ -0,0 +1,63 @@
+"""
+Cold-start budget check for `import main`.
+
+Imports the app in a fresh interpreter and fails (exit code 1) when the
+import takes longer than the budget or pulls in a module that must stay
+lazy. Run from the backend directory:
+
+    python -m bench.import_budget --budget-ms 700
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use / during warm-up, never by `import main`.
+LAZY_MODULES = ["openai", "numpy", "tifffile", "qrcode", "PIL"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "import_ms": round(elapsed * 1000, 1),
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def measure(runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE % (LAZY_MODULES,)],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enforce the import-time budget of main.py.")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "700")))
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters; the best run counts")
+    args = parser.parse_args(argv)
+
+    samples = measure(args.runs)
+    best = min(s["import_ms"] for s in samples)
+    loaded = sorted({m for s in samples for m in s["loaded"]})
+
+    report = {"budget_ms": args.budget_ms, "best_ms": best,
+              "runs_ms": [s["import_ms"] for s in samples], "eager_heavy_modules": loaded}
+    print(json.dumps(report, indent=2))
+
+    if loaded or best > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
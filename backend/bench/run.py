@@ -0,0 +1,222 @@
+"""
+End-to-end latency / throughput benchmark.
+
+Starts local upstream stubs, boots the FastAPI app with uvicorn pointed at
+them, load-tests the key endpoints and prints the results as JSON.
+
+Run from the backend directory:
+
+    python -m bench.run --requests 200 --concurrency 16 --latency 50 \
+        --stub-latency openai=400 --stub-errors cdse_process=0.05 --out bench.json
+
+Instead of stubs, `--record DIR` runs against the real upstreams and stores
+their responses, and `--replay DIR` serves those recordings back
+(see services/fixtures.py).
+
+Every run gets its own temporary ledger and state DB (removed on exit), so
+results do not depend on earlier runs; with --workers > 1 the state is
+shared through SQLite like in the Docker image.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.stubs import start_stubs
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, method, path, params)
+ENDPOINTS = [
+    ("generate_quest", "GET", "/generate_quest", {"lat": 48.72, "lon": 21.26}),
+    ("scan_qr", "GET", "/scan_qr", {"code": "park001"}),
+    ("complete_quest_by_qr", "GET", "/complete_quest_by_qr",
+     {"qr_key": "park001_q1_7fae4b", "user_lat": 48.7245, "user_lon": 21.2592}),
+    ("get_quest_qr", "GET", "/get_quest_qr", {"qr_key": "castle001_q1_8f3c2d"}),
+    ("leaderboard", "GET", "/leaderboard", {}),
+]
+
+
+# === HELPERS ===
+def parse_overrides(pairs):
+    """['openai=400', '80'] → {'openai': 400.0, 'default': 80.0}"""
+    table = {}
+    for item in pairs or []:
+        name, _, value = item.rpartition("=")
+        table[name or "default"] = float(value)
+    return table
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def start_app(env, port, workers):
+    cmd = [sys.executable, "-m", "uvicorn", "main:app",
+           "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env={**os.environ, **env})
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/ready", timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("uvicorn did not come up within 60 s")
+
+
+# === LOAD GENERATION ===
+def run_endpoint(base_url, method, path, params, total, concurrency, warmup):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            r = session.request(method, base_url + path, params=params, timeout=120)
+            ok = r.status_code < 400
+            size = len(r.content)
+        except requests.RequestException:
+            ok, size = False, 0
+        return time.perf_counter() - start, ok, size
+
+    for _ in range(warmup):
+        one(None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    errors = sum(1 for r in results if not r[1])
+    return {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "rps": round(total / wall, 2) if wall else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2),
+        "avg_bytes": int(sum(r[2] for r in results) / len(results)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backend against local upstream stubs.")
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=3, help="sequential requests before measuring")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--latency", type=float, default=0.0, help="default stub latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="default stub jitter in ms")
+    parser.add_argument("--errors", type=float, default=0.0, help="default stub error rate (0-1)")
+    parser.add_argument("--stub-latency", nargs="*", metavar="NAME=MS")
+    parser.add_argument("--stub-jitter", nargs="*", metavar="NAME=MS")
+    parser.add_argument("--stub-errors", nargs="*", metavar="NAME=RATE")
+    parser.add_argument("--record", metavar="DIR", help="hit the real upstreams and record fixtures")
+    parser.add_argument("--replay", metavar="DIR", help="serve recorded fixtures instead of stubs")
+    parser.add_argument("--replay-delay", choices=["original", "none"], default="original")
+    parser.add_argument("--endpoints", nargs="*", help="subset of endpoint names to run")
+    parser.add_argument("--out", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    latency = {"default": args.latency, **parse_overrides(args.stub_latency)}
+    jitter = {"default": args.jitter, **parse_overrides(args.stub_jitter)}
+    errors = {"default": args.errors, **parse_overrides(args.stub_errors)}
+
+    if args.record or args.replay:
+        stubs = {}
+        env = {
+            "FIXTURE_MODE": "record" if args.record else "replay",
+            "FIXTURE_DIR": os.path.abspath(args.record or args.replay),
+            "FIXTURE_DELAY": args.replay_delay,
+        }
+    else:
+        stubs, env = start_stubs(latency, jitter, errors)
+
+    state_dir = tempfile.mkdtemp(prefix="geoquest-bench-")
+    env["LEDGER_PATH"] = os.path.join(state_dir, "ledger.jsonl")
+    env["STATE_DB_PATH"] = os.path.join(state_dir, "state.db")
+    if args.workers > 1:  # per-process memory state would give every worker its own player
+        env["STATE_BACKEND"] = "sqlite"
+
+    port = free_port()
+    try:
+        app = start_app(env, port, args.workers)
+    except Exception:
+        for s in stubs.values():
+            s.stop()
+        shutil.rmtree(state_dir, ignore_errors=True)
+        raise
+    base_url = f"http://127.0.0.1:{port}"
+
+    selected = [e for e in ENDPOINTS if not args.endpoints or e[0] in args.endpoints]
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "workers": args.workers,
+            "state_backend": env.get("STATE_BACKEND", os.getenv("STATE_BACKEND", "memory")),
+            "fixtures": env.get("FIXTURE_MODE", "off"),
+            "stubs": {
+                name: {"latency_ms": s.latency_ms, "jitter_ms": s.jitter_ms, "error_rate": s.error_rate}
+                for name, s in stubs.items()
+            },
+        },
+        "endpoints": {},
+    }
+    try:
+        for name, method, path, params in selected:
+            report["endpoints"][name] = run_endpoint(
+                base_url, method, path, params, args.requests, args.concurrency, args.warmup
+            )
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+        report["upstream_calls"] = {name: s.stats() for name, s in stubs.items()}
+        for s in stubs.values():
+            s.stop()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Local stand-ins for the upstream APIs the backend talks to
+(Overpass, Open-Meteo, CDSE auth + process, OpenAI).
+
+Each stub runs its own HTTP server on a free port, so latency and
+error injection can be tuned per upstream.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+
+# === PAYLOADS ===
+TOURISM_TYPES = ["museum", "attraction", "viewpoint", "artwork", "hotel", "gallery"]
+
+
+def overpass_payload(body: str) -> dict:
+    """Fake tourism nodes scattered around the point in the Overpass query."""
+    match = re.search(r"around:\d+,([-\d.]+),([-\d.]+)", body)
+    lat, lon = (float(match.group(1)), float(match.group(2))) if match else (48.72, 21.26)
+    elements = []
+    for i in range(12):
+        elements.append({
+            "type": "node",
+            "id": 1000 + i,
+            "lat": lat + (i % 4) * 0.002,
+            "lon": lon + (i // 4) * 0.002,
+            "tags": {"name": f"Bench Place {i}", "tourism": TOURISM_TYPES[i % len(TOURISM_TYPES)]},
+        })
+    return {"elements": elements}
+
+
+def weather_payload(query: str) -> dict:
+    if "hourly=" in query:
+        return {"hourly": {
+            "time": [f"2025-11-08T{h:02d}:00" for h in range(24)],
+            "weathercode": [random.choice([0, 1, 2, 3, 61]) for _ in range(24)],
+            "temperature_2m": [round(random.uniform(2, 14), 1) for _ in range(24)],
+        }}
+    return {
+        "current_weather": {
+            "temperature": 12.4,
+            "windspeed": 8.1,
+            "winddirection": 240,
+            "weathercode": random.choice([0, 1, 2, 3, 61]),
+            "is_day": 1,
+            "time": "2025-11-08T12:00",
+        }
+    }
+
+
+def token_payload(body: str) -> dict:
+    return {"access_token": "bench-token", "refresh_token": "bench-refresh", "expires_in": 900}
+
+
+_TIFF_BYTES = None
+
+
+def tiff_payload(body: str) -> bytes:
+    """A 256x128 float32 NO2 tile, built once."""
+    global _TIFF_BYTES
+    if _TIFF_BYTES is None:
+        import numpy as np
+        import tifffile
+
+        buf = BytesIO()
+        tile = np.random.default_rng(7).uniform(0.0001, 0.0009, (128, 256)).astype("float32")
+        tifffile.imwrite(buf, tile)
+        _TIFF_BYTES = buf.getvalue()
+    return _TIFF_BYTES
+
+
+def openai_payload(body: str):
+    if '"stream": true' in body or '"stream":true' in body:
+        return openai_stream_payload(), "text/event-stream"
+    content = json.dumps({
+        "place": "Bench Place",
+        "goal": "Find the oldest detail on the facade.",
+        "reward": "30 XP",
+        "educational_info": "Bench places are generated locally.",
+        "type": "museum",
+        "indoor_outdoor": "indoor",
+    })
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4o-mini",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 250, "completion_tokens": 60, "total_tokens": 310},
+    }
+
+
+def openai_stream_payload() -> bytes:
+    """SSE chunks like the real streaming API: a few content deltas, then usage."""
+    words = "Perfect weather for a bench quest today — let's go!".split(" ")
+    events = []
+    for i, word in enumerate(words):
+        events.append({
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk",
+            "created": int(time.time()), "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+        })
+    events.append({
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk",
+        "created": int(time.time()), "model": "gpt-4o-mini", "choices": [],
+        "usage": {"prompt_tokens": 80, "completion_tokens": len(words), "total_tokens": 80 + len(words)},
+    })
+    body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+    return body.encode()
+
+
+# === SERVER ===
+class StubServer:
+    """
+    One upstream stub. `latency_ms` (+/- `jitter_ms`) is slept before every
+    response and `error_rate` of the requests answer with HTTP 500.
+    """
+
+    def __init__(self, name, payload, content_type="application/json",
+                 latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.name = name
+        self.payload = payload
+        self.content_type = content_type
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.hits = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, body_text):
+                with stub._lock:
+                    stub.hits += 1
+                    failed = random.random() < stub.error_rate
+                    if failed:
+                        stub.errors += 1
+
+                delay = stub.latency_ms + random.uniform(-stub.jitter_ms, stub.jitter_ms)
+                if delay > 0:
+                    time.sleep(delay / 1000)
+
+                if failed:
+                    self._send(500, b'{"error": "injected failure"}', "application/json")
+                    return
+
+                data = stub.payload(body_text)
+                content_type = stub.content_type
+                if isinstance(data, tuple):  # (body, content type override)
+                    data, content_type = data
+                if isinstance(data, (dict, list)):
+                    data = json.dumps(data).encode()
+                self._send(200, data, content_type)
+
+            def _send(self, status, data, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond(self.path)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                self._respond(raw.decode("utf-8", "replace"))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        return {"hits": self.hits, "errors": self.errors}
+
+
+def start_stubs(latency=None, jitter=None, errors=None):
+    """
+    Start all upstream stubs. `latency`, `jitter` and `errors` map stub name
+    → value and fall back to the "default" key.
+    Returns the stubs and the env vars that point the backend at them.
+    """
+    latency, jitter, errors = latency or {}, jitter or {}, errors or {}
+
+    def opt(table, name):
+        return table.get(name, table.get("default", 0.0))
+
+    specs = {
+        "overpass": (overpass_payload, "application/json"),
+        "open_meteo": (weather_payload, "application/json"),
+        "cdse_auth": (token_payload, "application/json"),
+        "cdse_process": (tiff_payload, "image/tiff"),
+        "openai": (openai_payload, "application/json"),
+    }
+    stubs = {
+        name: StubServer(name, payload, content_type,
+                         latency_ms=opt(latency, name),
+                         jitter_ms=opt(jitter, name),
+                         error_rate=opt(errors, name)).start()
+        for name, (payload, content_type) in specs.items()
+    }
+
+    env = {
+        "OVERPASS_URL": stubs["overpass"].url + "/api/interpreter",
+        "OPEN_METEO_URL": stubs["open_meteo"].url + "/v1/forecast",
+        "CDSE_TOKEN_URL": stubs["cdse_auth"].url + "/auth/realms/CDSE/protocol/openid-connect/token",
+        "CDSE_PROCESS_URL": stubs["cdse_process"].url + "/api/v1/process",
+        "OPENAI_BASE_URL": stubs["openai"].url + "/v1",
+        "OPENAI_API_KEY": "bench",
+    }
+    return stubs, env
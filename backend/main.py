@@ -1,25 +1,117 @@
-from fastapi import FastAPI, Query
+from dotenv import load_dotenv
+
+load_dotenv()  # before services/* read their env config
+
+from fastapi import FastAPI, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from starlette.routing import Match
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from datetime import datetime
 from io import BytesIO
-import qrcode
+import asyncio
+import hashlib
+import json
+import math
 import os
+import threading
+import time
 from uuid import uuid4  # ✅ for quest IDs
 
 # === Services ===
 from services.places import get_nearby_places
-from services.weather import get_weather
-from services.quest_gen import generate_quest, ai_recommendation
-from services.logic import choose_best_quest
-from services.zones import find_zone_by_code, load_zones
-from services.quest_gen import check_quest_weather_and_recommend
-from utils.calc import haversine
+from services.weather import get_weather, peek_weather, weather_at
+from services.quest_gen import QUEST_MODES, quest_for_place, ai_recommendation, ai_recommendation_stream
+from services.logic import get_weather_multiplier, rank_quests
+from services.zones import find_zone_by_code, find_quest_by_qr_key, get_catalog
+from services.quest_gen import attach_indoor_alternatives, check_quest_weather_and_recommend
+from services import metrics, profiling, upstream
+from services.state import (
+    load_player, player_session, load_public_quests, save_public_quests, get_public_quest, add_public_quests
+)
+from services.llm import get_client
+from services.tracking import TrackError, parse_ndjson, ingest
+from services.geofence import update_position
+from services import heatmap, itinerary, ledger
+from services.push import player_updates
+from services.store import store
+from services.places import OVERPASS_URL
+from services.weather import OPEN_METEO_URL, CDSE_PROCESS_URL
+from services.copernicus_auth import CDSE_TOKEN_URL
+from utils.calc import haversine, haversine_vec
+from utils.grid import tile_bbox
+from utils.payload import FastJSONResponse, shape_quests
 
-# === Setup ===
-app = FastAPI()
 QR_DIR = "qr_codes"
 
+
+# === QR CACHE ===
+# qrcode/PIL are imported on first render, not at startup.
+QR_PNG_CACHE = {}
+
+
+def quest_qr_png(qr_key: str) -> bytes:
+    """PNG bytes of a quest QR code, rendered once per key."""
+    png = QR_PNG_CACHE.get(qr_key)
+    metrics.cache_lookup("quest_qr_png", png is not None)
+    if png is None:
+        import qrcode
+
+        buf = BytesIO()
+        qrcode.make(qr_key).save(buf, format="PNG")
+        png = QR_PNG_CACHE[qr_key] = buf.getvalue()
+    return png
+
+
+# === STARTUP & READINESS ===
+readiness = {"ready": False, "warmup_s": None, "steps": {}}
+
+
+def _import_heavy_modules():
+    import numpy  # noqa: F401
+    import tifffile  # noqa: F401
+    import qrcode  # noqa: F401
+
+
+def warm_up():
+    """Preload zones, the QR cache, heavy modules and upstream connections."""
+    started = time.perf_counter()
+
+    def step(name, fn):
+        t = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            print(f"Warm-up error ({name}):", e)
+        readiness["steps"][name] = round(time.perf_counter() - t, 4)
+
+    step("zones", get_catalog)
+    step("qr_cache", lambda: [quest_qr_png(qr_key) for qr_key in get_catalog().qr_keys()])
+    step("heavy_imports", _import_heavy_modules)
+    step("llm_client", get_client)
+    step("connection_pools", lambda: upstream.warm_up(
+        [OVERPASS_URL, OPEN_METEO_URL, CDSE_TOKEN_URL, CDSE_PROCESS_URL]
+    ))
+
+    readiness["warmup_s"] = round(time.perf_counter() - started, 4)
+    readiness["ready"] = True
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Serve /ready (503) right away and warm up in the background.
+    threading.Thread(target=warm_up, daemon=True).start()
+    metrics.start_publishing(store)
+    if heatmap.PREWARM_INTERVAL_S > 0:
+        heatmap.start(warm_area)
+    yield
+
+
+# === Setup ===
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
 # === CORS ===
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +121,99 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# === LEDGER ERRORS ===
+@app.exception_handler(ledger.InFlight)
+async def ledger_in_flight(request: Request, exc: ledger.InFlight):
+    return JSONResponse({"error": str(exc)}, status_code=409)
+
+
+@app.exception_handler(ledger.LedgerError)
+async def ledger_failed(request: Request, exc: ledger.LedgerError):
+    """The write was rolled back (see services/ledger.py); the client may retry."""
+    return JSONResponse({"error": "Could not record the transaction, please retry."}, status_code=503)
+
+
+# === METRICS ===
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus text exposition of request, upstream, cache and LLM metrics,
+    summed over all workers (see services/metrics.py).
+    """
+    return PlainTextResponse(metrics.collect(store), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once warm-up has finished, 503 before."""
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+# === PROFILING ===
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    Sample-profile the request when asked via `X-Profile: 1` or `?profile=1`
+    with the operator's `X-Profile-Token`.
+    """
+    if not profiling.wants_profile(request.headers, request.query_params):
+        return await call_next(request)
+
+    endpoint = next(
+        (r.endpoint for r in app.router.routes if r.matches(request.scope)[0] == Match.FULL),
+        None
+    )
+    if endpoint is None:
+        return await call_next(request)
+
+    request_id = request.headers.get("x-request-id", "")
+    if not profiling.REQUEST_ID_RE.match(request_id):
+        request_id = uuid4().hex
+
+    with profiling.Sampler(endpoint.__code__) as sampler:
+        response = await call_next(request)
+    profiling.save(request_id, request.url.path, sampler)
+
+    response.headers["X-Profile-ID"] = request_id
+    return response
+
+
+@app.get("/debug/profiles/{request_id}")
+def get_profile(request: Request, request_id: str, format: str = "json"):
+    """Stored profile: JSON summary, or collapsed stacks with `format=folded` (needs X-Profile-Token)."""
+    if not profiling.authorized(request.headers):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    if format == "folded":
+        folded = profiling.load(request_id, "folded")
+        if folded is None:
+            return {"error": "Profile not found."}
+        return PlainTextResponse(folded)
+
+    summary = profiling.load(request_id, "json")
+    if summary is None:
+        return {"error": "Profile not found."}
+    return summary
+
 # === MODELS ===
 class Quest(BaseModel):
     lat: float
@@ -43,26 +228,29 @@ class CompleteQuestRequest(BaseModel):
     current_lon: float
 
 
+class OfflineCompletion(BaseModel):
+    id: str  # generated by the client when queuing; idempotency key of this completion
+    qr_key: str
+    lat: float
+    lon: float
+    completed_at: datetime
+
+
+class SyncRequest(BaseModel):
+    completions: list[OfflineCompletion]
+
+
+class ItineraryRequest(BaseModel):
+    lat: float
+    lon: float
+    quest_ids: list[str] = []
+    zone: str = None
+    max_km: float = None
+    time_budget_ms: int = 250
+
+
 # === HELPERS ===
-def get_weather_multiplier(code: int) -> float:
-    """Return reward multiplier based on weather code."""
-    if code in [0, 1, 2]:  # clear / partly cloudy
-        return 1.0
-    if code in [3]:  # overcast
-        return 1.1
-    if code in [45, 48]:  # fog
-        return 1.2
-    if code in [51, 53, 55]:  # drizzle
-        return 1.2
-    if code in [61, 63, 65, 80, 81, 82]:  # rain
-        return 1.3
-    if code in [66, 67]:  # freezing rain
-        return 1.4
-    if code in [71, 73, 75, 85, 86]:  # snow
-        return 1.4
-    if code in [95, 96, 99]:  # thunderstorms
-        return 1.5
-    return 1.0
+# get_weather_multiplier lives in services/logic.py (shared with quest ranking).
 
 
 # === ACHIEVEMENTS SYSTEM ===
@@ -128,22 +316,7 @@ def calculate_geobucks(weather):
 
 
 # === GAME STATE ===
-current_public_quests = []
-
-player = {
-    "id": 1,
-    "name": "Traveler",
-    "level": 7,            # ⚡ Looks experienced for demo
-    "xp": 220,
-    "geobucks": 135,       # 💰 Some currency to show off purchases
-    "active_quest": None,
-    "progress": {
-        "quests_completed": 14,     # 🏆 Achievements in progress
-        "distance_walked": 12.7
-    },
-    "achievements": ["walk_10km", "finish_10_quests"]  # already unlocked a few
-}
-
+# Player and public quests live in services/state.py (shared across workers).
 
 
 def xp_for_next_level(level: int) -> int:
@@ -162,37 +335,41 @@ def add_xp(player, xp_gained: int):
     return leveled_up
 
 
-# === PUBLIC QUESTS ===
-@app.get("/generate_quest")
-def generate(lat: float = Query(...), lon: float = Query(...)):
+# === QUEST PAYLOADS ===
+def quest_response(payload: dict, key: str, fields: str = None, dedupe: bool = False):
     """
-    Generate public AI quests (not automatically assigned).
-    Stores them in memory for player selection.
+    Shape payload[key] (sparse fieldset / weather de-duplication) and return
+    it as an orjson response, bypassing FastAPI's generic encoder.
     """
-    global current_public_quests
+    quests, weather = shape_quests(payload[key], fields, dedupe)
+    payload = {**payload, key: quests}
+    if weather is not None:
+        payload["weather"] = weather
+    return FastJSONResponse(payload)
+
 
+# === PUBLIC QUESTS ===
+def public_quests_near(lat: float, lon: float, mode: str = None):
+    """
+    POIs → public places → quests with weather and rewards.
+    `mode` picks LLM or template quests (see services/quest_gen.py).
+    Returns (quests, None) or (None, error message).
+    """
     places = get_nearby_places(lat, lon)
     if not places:
-        return {"error": "No places found nearby"}
+        return None, "No places found nearby"
 
     # --- Filter out private/duplicate places ---
-    private_zones = load_zones()
-    private_names = {zone["name"].lower() for zone in private_zones}
-    private_quest_places = {
-        quest["place"].lower()
-        for zone in private_zones
-        for quest in zone["quests"]
-    }
-    excluded_places = private_names | private_quest_places
+    excluded_places = get_catalog().place_names  # zone names + zone quest places
 
     public_places = [p for p in places if p["name"].lower() not in excluded_places]
     if not public_places:
-        return {"error": "No public places available (too close to private zones)"}
+        return None, "No public places available (too close to private zones)"
 
     # --- Generate and enrich quests ---
     quests = []
     for p in public_places[:3]:
-        q = generate_quest(p)
+        q = quest_for_place(p, mode)
         q["id"] = str(uuid4())  # ✅ unique quest ID
         weather = get_weather(q["lat"], q["lon"])
         multiplier = get_weather_multiplier(weather["weathercode"])
@@ -201,30 +378,190 @@ def generate(lat: float = Query(...), lon: float = Query(...)):
         q.update(reward_info)
         quests.append(q)
 
-    current_public_quests = quests  # ✅ store globally
+    # Nearest indoor places per outdoor quest for bad-weather swaps
+    attach_indoor_alternatives(quests, places)
+    return quests, None
 
-    return {
+
+def warm_area(lat: float, lon: float):
+    """Pre-warm job: fill the POI, weather, air quality and quest caches for an area."""
+    public_quests_near(lat, lon, "llm")
+
+
+@app.get("/generate_quest")
+def generate(lat: float = Query(...), lon: float = Query(...), mode: str = Query(None),
+             fields: str = Query(None), dedupe: bool = False):
+    """
+    Generate public AI quests (not automatically assigned).
+    Stores them in the shared state for player selection.
+    mode=fast returns template quests without LLM calls; mode=auto (default)
+    falls back to them while the LLM is saturated.
+    """
+    if mode is not None and mode not in QUEST_MODES:
+        return {"error": f"mode must be one of: {', '.join(QUEST_MODES)}"}
+    heatmap.record(lat, lon)
+    quests, error = public_quests_near(lat, lon, mode)
+    if error:
+        return {"error": error}
+
+    save_public_quests(quests)  # ✅ store globally
+
+    return quest_response({
         "message": "New quests generated successfully.",
         "available_quests": quests
+    }, "available_quests", fields, dedupe)
+
+
+@app.get("/heatmap")
+def get_heatmap(limit: int = Query(20, ge=1, le=500)):
+    """Hottest /generate_quest areas (decayed request counts), as used by pre-warming."""
+    return {
+        "half_life_h": heatmap.HALF_LIFE_S / 3600,
+        "areas": [{"lat": lat, "lon": lon, "score": score} for lat, lon, score in heatmap.hottest(limit)],
     }
 
 
 @app.get("/get_available_quests")
-def get_available_quests():
+def get_available_quests(fields: str = Query(None), dedupe: bool = False):
     """Return the last generated public quests."""
-    if not current_public_quests:
+    quests = load_public_quests()
+    if not quests:
         return {"error": "No quests generated yet."}
-    return {"available_quests": current_public_quests}
+    return quest_response({"available_quests": quests}, "available_quests", fields, dedupe)
 
 
 @app.post("/ai_guide")
-def guide_message(quest: dict):
-    return {"message": ai_recommendation(quest)}
+def guide_message(quest: dict, stream: bool = False):
+    """
+    Motivational message for a quest. With ?stream=true it is sent as
+    server-sent events: "token" events as text arrives, then "done".
+    """
+    if not stream:
+        return {"message": ai_recommendation(quest)}
+
+    def events():
+        parts = []
+        for chunk in ai_recommendation_stream(quest):
+            parts.append(chunk)
+            yield f"event: token\ndata: {json.dumps({'text': chunk})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'message': ''.join(parts).strip()})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# === RECOMMENDATIONS ===
+RECOMMEND_RADIUS = 5000  # m — zone quests considered around the player
+
+
+def zone_candidates(lat: float, lon: float, radius: float):
+    """
+    Zone quests around (lat, lon) as ranking candidates. Weather is only
+    taken from the cache here (no upstream calls); the winners are
+    enriched with live weather afterwards.
+    """
+    dlat = radius / 111_195.0
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    catalog = get_catalog()
+    weather_by_cell = {}
+    candidates = []
+    for code in catalog.in_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+        for quest in catalog.by_code[code]["quests"]:
+            cell = (round(quest["lat"], 3), round(quest["lon"], 3))
+            if cell not in weather_by_cell:
+                weather_by_cell[cell] = peek_weather(quest["lat"], quest["lon"])
+            candidate = {k: v for k, v in quest.items() if k != "qr_key"}
+            candidate.update(source="zone", zone=code, weather=weather_by_cell[cell])
+            candidates.append(candidate)
+    return candidates
+
+
+@app.get("/recommend_quests")
+def recommend_quests(
+    lat: float = Query(...),
+    lon: float = Query(...),
+    k: int = Query(5, ge=1, le=50),
+    radius: float = Query(RECOMMEND_RADIUS, gt=0, le=50_000),
+    include_zones: bool = True,
+    fields: str = Query(None),
+    dedupe: bool = False,
+):
+    """
+    Rank public and nearby zone quests for the player (distance, weather,
+    air quality, indoor/outdoor fit, reward) and return the top k.
+    """
+    candidates = [{**q, "source": "public"} for q in load_public_quests()]
+    if include_zones:
+        candidates += zone_candidates(lat, lon, radius)
+    if not candidates:
+        return {"error": "No quests available nearby."}
+
+    recommendations = []
+    for score, quest, breakdown in rank_quests(candidates, lat, lon, k=k):
+        if quest["source"] == "zone":
+            weather = get_weather(quest["lat"], quest["lon"])
+            reward_info = apply_reward_multiplier(quest["reward"], get_weather_multiplier(weather["weathercode"]))
+            quest = {**quest, "weather": weather, **reward_info}
+        recommendations.append({
+            **quest,
+            "score": round(score, 4),
+            "distance_m": round(breakdown.pop("distance_m"), 1),
+            "score_breakdown": {name: round(v, 3) for name, v in breakdown.items()},
+        })
+
+    return quest_response({
+        "candidates": len(candidates),
+        "recommendations": recommendations,
+    }, "recommendations", fields, dedupe)
+
+
+@app.post("/itinerary")
+def plan_itinerary(req: ItineraryRequest):
+    """
+    Best walking order for the selected quests (quest_ids and/or every quest
+    of `zone`) from the player's position, weighted by reward and weather.
+    """
+    catalog = get_catalog()
+
+    selected = {}
+    if req.zone:
+        zone = catalog.by_code.get(req.zone)
+        if not zone:
+            return {"error": "Unknown zone"}
+        for quest in zone["quests"]:
+            selected[quest["id"]] = (zone["code"], quest)
+    for quest_id in req.quest_ids:
+        public = get_public_quest(quest_id)
+        if public:
+            selected[quest_id] = (None, public)
+        elif quest_id in catalog.by_quest_id:
+            zone, quest = catalog.by_quest_id[quest_id]
+            selected[quest_id] = (zone["code"], quest)
+        else:
+            return {"error": f"Unknown quest {quest_id}"}
+
+    if not selected:
+        return {"error": "No quests selected"}
+    if len(selected) > itinerary.MAX_STOPS:
+        return JSONResponse({"error": f"At most {itinerary.MAX_STOPS} stops"}, status_code=400)
+
+    stops = []
+    for zone_code, quest in selected.values():
+        if zone_code is None:
+            stops.append({**quest, "source": "public"})
+        else:
+            stop = {k: v for k, v in quest.items() if k != "qr_key"}
+            stop.update(source="zone", zone=zone_code, weather=peek_weather(quest["lat"], quest["lon"]))
+            stops.append(stop)
+
+    max_m = req.max_km * 1000 if req.max_km else None
+    budget = min(max(req.time_budget_ms, 10), 2000) / 1000
+    return itinerary.plan((req.lat, req.lon), stops, max_m=max_m, time_budget=budget)
 
 
 # === PRIVATE QUESTS (QR ZONES) ===
 @app.get("/scan_qr")
-def scan_qr(code: str):
+def scan_qr(code: str, fields: str = Query(None), dedupe: bool = False):
     """
     Scan a zone QR code → returns all quests with weather & multiplier.
     """
@@ -240,77 +577,208 @@ def scan_qr(code: str):
         quest_with_weather = {**quest, "weather": weather, **reward_info}
         quests_with_weather.append(quest_with_weather)
 
-    return {
+    return quest_response({
         "zone": {
             "name": zone["name"],
             "description": zone["description"],
             "type": zone["type"]
         },
         "quests": quests_with_weather
-    }
+    }, "quests", fields, dedupe)
 
 
 @app.get("/complete_quest_by_qr")
 def complete_quest_by_qr(
     qr_key: str = Query(...),
     user_lat: float = Query(...),
-    user_lon: float = Query(...)
+    user_lon: float = Query(...),
+    idempotency_key: str = Header(None)
 ):
     """
     Complete a specific quest by scanning its QR code.
     Verifies both the secret qr_key and the player's proximity (within 25 m).
     Adds XP to the player when successful.
     """
-    zones = load_zones()
-    for zone in zones:
-        for quest in zone["quests"]:
-            if quest.get("qr_key") == qr_key:
-                q_lat = quest["lat"]
-                q_lon = quest["lon"]
-                distance = haversine(user_lat, user_lon, q_lat, q_lon)
-                weather = get_weather(q_lat, q_lon)
-                multiplier = get_weather_multiplier(weather["weathercode"])
-                reward_info = apply_reward_multiplier(quest["reward"], multiplier)
-
-                # Extract XP
-                try:
-                    xp_gained = int(reward_info["final_reward"].split()[0])
-                except Exception:
-                    xp_gained = 20
-
-                if distance < 25:
-                    leveled_up = add_xp(player, xp_gained)
-                    geobucks_gained = reward_info.get("geobucks_reward", 0)
-                    player["geobucks"] += geobucks_gained
-
-                    return {
-                        "status": "completed",
-                        "message": (
-                            f"You completed '{quest['goal']}' at {quest['place']} "
-                            f"and earned {reward_info['final_reward']}!"
-                        ),
-                        "quest": quest,
-                        "weather": weather,
-                        **reward_info,
-                        "xp_gained": xp_gained,
-                        "new_level": player["level"],
-                        "current_xp": player["xp"],
-                        "leveled_up": leveled_up,
-                        "distance_m": round(distance, 1),
-                        "geobucks_gained": geobucks_gained,
-                        "total_geobucks": player["geobucks"],
-                    }
-                else:
-                    return {
-                        "status": "too_far",
-                        "message": f"You are {int(distance)} m away — move closer to complete it!",
-                        "quest": quest,
-                        "weather": weather,
-                        **reward_info,
-                        "distance_m": round(distance, 1)
-                    }
-
-    return {"status": "error", "message": "Invalid or expired QR code."}
+    zone, quest = find_quest_by_qr_key(qr_key)
+    if not quest:
+        return {"status": "error", "message": "Invalid or expired QR code."}
+
+    q_lat = quest["lat"]
+    q_lon = quest["lon"]
+    distance = haversine(user_lat, user_lon, q_lat, q_lon)
+    weather = get_weather(q_lat, q_lon)
+    multiplier = get_weather_multiplier(weather["weathercode"])
+    reward_info = apply_reward_multiplier(quest["reward"], multiplier)
+
+    # Extract XP
+    try:
+        xp_gained = int(reward_info["final_reward"].split()[0])
+    except Exception:
+        xp_gained = 20
+
+    if distance < 25:
+        with ledger.session(idempotency_key) as txn:
+            previous = ledger.replayed(idempotency_key)
+            if previous:
+                return previous
+
+            player = txn.player
+            leveled_up = add_xp(player, xp_gained)
+            geobucks_gained = reward_info.get("geobucks_reward", 0)
+            txn.post(geobucks_gained, "complete_quest_by_qr",
+                     ref=quest["id"], idempotency_key=idempotency_key)
+
+            result = {
+                "status": "completed",
+                "message": (
+                    f"You completed '{quest['goal']}' at {quest['place']} "
+                    f"and earned {reward_info['final_reward']}!"
+                ),
+                "quest": quest,
+                "weather": weather,
+                **reward_info,
+                "xp_gained": xp_gained,
+                "new_level": player["level"],
+                "current_xp": player["xp"],
+                "leveled_up": leveled_up,
+                "distance_m": round(distance, 1),
+                "geobucks_gained": geobucks_gained,
+                "total_geobucks": player["geobucks"],
+            }
+
+        ledger.remember(idempotency_key, result)
+        return result
+    else:
+        return {
+            "status": "too_far",
+            "message": f"You are {int(distance)} m away — move closer to complete it!",
+            "quest": quest,
+            "weather": weather,
+            **reward_info,
+            "distance_m": round(distance, 1)
+        }
+
+
+# === OFFLINE SYNC ===
+SYNC_MAX_BATCH = 500
+SYNC_MAX_AGE_S = 7 * 86400  # older queued completions are refused
+SYNC_CLOCK_SKEW_S = 300
+QR_RADIUS_M = 25  # same proximity rule as /complete_quest_by_qr
+
+
+@app.post("/sync_completions")
+def sync_completions(req: SyncRequest):
+    """
+    Apply QR completions queued while offline (qr_key, position, time) in one
+    request. Positions are checked against the quests in one vectorized pass,
+    rewards use the weather at completion time, and all XP and GeoBucks are
+    applied in one player session with one ledger commit. Each completion's
+    `id` is its idempotency key, so re-sending a batch after a lost response
+    is safe.
+    """
+    import numpy as np
+
+    if len(req.completions) > SYNC_MAX_BATCH:
+        return JSONResponse({"error": f"At most {SYNC_MAX_BATCH} completions per sync"}, status_code=400)
+
+    now = time.time()
+    results = [None] * len(req.completions)
+    candidates = []  # (index, completion, timestamp, quest)
+    seen = set()
+    for i, c in enumerate(req.completions):
+        ts = c.completed_at.timestamp()
+        previous = ledger.replayed(f"sync:{c.id}")
+        if previous:
+            results[i] = {**previous, "replayed": True}
+        elif c.id in seen:
+            results[i] = {"id": c.id, "status": "duplicate"}
+        elif not now - SYNC_MAX_AGE_S <= ts <= now + SYNC_CLOCK_SKEW_S:
+            results[i] = {"id": c.id, "status": "invalid_time"}
+        else:
+            zone, quest = find_quest_by_qr_key(c.qr_key)
+            if not quest:
+                results[i] = {"id": c.id, "status": "invalid_qr"}
+            else:
+                candidates.append((i, c, ts, quest))
+        seen.add(c.id)
+
+    accepted = []
+    if candidates:
+        distances = haversine_vec(
+            np.array([c.lat for _, c, _, _ in candidates]), np.array([c.lon for _, c, _, _ in candidates]),
+            np.array([q["lat"] for *_, q in candidates]), np.array([q["lon"] for *_, q in candidates]),
+        )
+        for (i, c, ts, quest), distance in zip(candidates, distances.tolist()):
+            if distance < QR_RADIUS_M:
+                accepted.append((i, c, ts, quest, distance))
+            else:
+                results[i] = {"id": c.id, "status": "too_far", "quest_id": quest["id"],
+                              "distance_m": round(distance, 1)}
+
+    # Weather at completion time, once per ~100 m cell and hour
+    weather_by_slot = {}
+    rewards = {}
+    for i, c, ts, quest, _ in accepted:
+        slot = (round(quest["lat"], 3), round(quest["lon"], 3), int(ts // 3600))
+        if slot not in weather_by_slot:
+            weather_by_slot[slot] = weather_at(quest["lat"], quest["lon"], ts)
+        weather = weather_by_slot[slot]
+        rewards[i] = (weather, apply_reward_multiplier(quest["reward"], get_weather_multiplier(weather["weathercode"])))
+
+    completed = []
+    totals = {"xp_gained": 0, "geobucks_gained": 0}
+    leveled_up = False
+    with ledger.session() as txn:
+        player = txn.player
+        for i, c, ts, quest, distance in sorted(accepted, key=lambda a: a[2]):
+            key = f"sync:{c.id}"
+            previous = ledger.replayed(key)  # a concurrent retry of the same batch
+            if previous:
+                results[i] = {**previous, "replayed": True}
+                continue
+            if ledger.in_flight(key):
+                results[i] = {"id": c.id, "status": "in_progress", "quest_id": quest["id"]}
+                continue
+
+            weather, reward_info = rewards[i]
+            try:
+                xp_gained = int(reward_info["final_reward"].split()[0])
+            except Exception:
+                xp_gained = 20
+            geobucks_gained = reward_info.get("geobucks_reward", 0)
+
+            leveled_up = add_xp(player, xp_gained) or leveled_up
+            txn.post(geobucks_gained, "sync_completion", ref=quest["id"], idempotency_key=key)
+            totals["xp_gained"] += xp_gained
+            totals["geobucks_gained"] += geobucks_gained
+
+            results[i] = {
+                "id": c.id,
+                "status": "completed",
+                "quest_id": quest["id"],
+                "place": quest["place"],
+                "completed_at": c.completed_at.isoformat(),
+                "weather": weather,
+                **reward_info,
+                "xp_gained": xp_gained,
+                "geobucks_gained": geobucks_gained,
+                "distance_m": round(distance, 1),
+            }
+            completed.append((key, results[i]))
+
+        summary = {
+            "synced": sum(1 for r in results if r["status"] == "completed" and not r.get("replayed")),
+            "rejected": sum(1 for r in results if r["status"] not in ("completed", "in_progress")),
+            **totals,
+            "new_level": player["level"],
+            "current_xp": player["xp"],
+            "total_geobucks": player["geobucks"],
+            "leveled_up": leveled_up,
+        }
+
+    for key, result in completed:
+        ledger.remember(key, result)
+    return {**summary, "results": results}
 
 
 # === QR GENERATION ===
@@ -324,7 +792,11 @@ def get_qr_code(code: str):
     os.makedirs(QR_DIR, exist_ok=True)
     file_path = os.path.join(QR_DIR, f"{code}.png")
 
-    if not os.path.exists(file_path):
+    cached = os.path.exists(file_path)
+    metrics.cache_lookup("qr_png", cached)
+    if not cached:
+        import qrcode
+
         img = qrcode.make(code)
         img.save(file_path)
 
@@ -334,28 +806,90 @@ def get_qr_code(code: str):
 @app.get("/get_quest_qr")
 def get_quest_qr(qr_key: str):
     """Generate a QR image for a specific quest."""
-    zones = load_zones()
-    for zone in zones:
-        for quest in zone["quests"]:
-            if quest.get("qr_key") == qr_key:
-                img = qrcode.make(qr_key)
-                buf = BytesIO()
-                img.save(buf, format="PNG")
-                buf.seek(0)
-                return StreamingResponse(buf, media_type="image/png")
-    return {"error": "Invalid qr_key"}
+    zone, quest = find_quest_by_qr_key(qr_key)
+    if not quest:
+        return {"error": "Invalid qr_key"}
+    return Response(quest_qr_png(qr_key), media_type="image/png")
+
+
+# === ZONE MAP ===
+ZONES_PAGE_SIZE = 100
+ZONES_MAX_PAGE_SIZE = 1000
+ZONES_MAX_AGE = 60  # s, Cache-Control for map clients
+
+
+def zone_page(request: Request, bbox, offset: int, limit: int):
+    """
+    One page of zone summaries in bbox (min_lat, min_lon, max_lat, max_lon).
+    The ETag depends on the zone file version and the query, so unchanged
+    pages are answered with 304 before the index is even queried.
+    """
+    catalog = get_catalog()
+    etag = '"' + hashlib.sha1(
+        f"{catalog.version}|{bbox}|{offset}|{limit}".encode()
+    ).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={ZONES_MAX_AGE}"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    codes = catalog.in_bbox(*bbox)
+    page = codes[offset:offset + limit]
+    next_offset = offset + limit if offset + limit < len(codes) else None
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return FastJSONResponse({
+        "bbox": [min_lon, min_lat, max_lon, max_lat],
+        "total": len(codes),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset,
+        "zones": [catalog.summaries[code] for code in page],
+    }, headers=headers)
+
+
+@app.get("/zones")
+def list_zones(
+    request: Request,
+    bbox: str = Query(..., description="min_lon,min_lat,max_lon,max_lat"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(ZONES_PAGE_SIZE, ge=1, le=ZONES_MAX_PAGE_SIZE),
+):
+    """Zones whose centre or any quest lies in the bounding box (no QR keys)."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        return JSONResponse({"error": "bbox must be min_lon,min_lat,max_lon,max_lat"}, status_code=400)
+    if min_lat > max_lat or min_lon > max_lon:
+        return JSONResponse({"error": "bbox min must not exceed max"}, status_code=400)
+    return zone_page(request, (min_lat, min_lon, max_lat, max_lon), offset, limit)
+
+
+@app.get("/zones/{z}/{x}/{y}")
+def zone_tile(
+    request: Request, z: int, x: int, y: int,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(ZONES_PAGE_SIZE, ge=1, le=ZONES_MAX_PAGE_SIZE),
+):
+    """Same as /zones for one slippy-map tile."""
+    try:
+        bbox = tile_bbox(z, x, y)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return zone_page(request, bbox, offset, limit)
 
 
 # === PLAYER SYSTEM ===
 @app.get("/player")
 def get_player():
     """Get current dummy player status."""
-    return player
+    return load_player()
 
 
 @app.get("/get_active_quest")
 def get_active_quest():
     """Return player's active quest, if any."""
+    player = load_player()
     if not player["active_quest"]:
         return {"active_quest": None, "message": "No active quest selected."}
     return {"active_quest": player["active_quest"]}
@@ -364,29 +898,32 @@ def get_active_quest():
 @app.post("/set_active_quest")
 def set_active_quest(quest_id: str = Query(...)):
     """Player chooses an active quest by ID."""
-    global current_public_quests
-
-    if not current_public_quests:
-        return {"error": "No available quests. Generate some first."}
-
-    quest = next((q for q in current_public_quests if q["id"] == quest_id), None)
+    quest = get_public_quest(quest_id)
     if not quest:
+        if not load_public_quests():
+            return {"error": "No available quests. Generate some first."}
         return {"error": "Invalid quest ID."}
 
-    player["active_quest"] = quest
+    with player_session() as player:
+        player["active_quest"] = quest
     return {"message": f"Quest '{quest['place']}' set as active.", "active_quest": quest}
 
 
 @app.post("/complete_active_quest")
 def complete_active_quest(
     current_lat: float = Query(...),
-    current_lon: float = Query(...)
+    current_lon: float = Query(...),
+    idempotency_key: str = Header(None)
 ):
     """Mark player's active quest as completed and add XP + GeoBucks if close enough."""
-    if not player["active_quest"]:
+    previous = ledger.replayed(idempotency_key)
+    if previous:
+        return previous
+
+    quest = load_player()["active_quest"]
+    if not quest:
         return {"error": "No active quest assigned."}
 
-    quest = player["active_quest"]
     q_lat = quest["lat"]
     q_lon = quest["lon"]
 
@@ -410,38 +947,52 @@ def complete_active_quest(
     except Exception:
         xp = 20
 
-    leveled_up = add_xp(player, xp)
-
     # 💰 Calculate GeoBucks based on environment
     geobucks_gained = calculate_geobucks(weather)
-    player["geobucks"] += geobucks_gained
 
-    # Reset quest
-    player["active_quest"] = None
+    with ledger.session(idempotency_key) as txn:
+        # A retry with the same key may have completed it while we fetched weather
+        previous = ledger.replayed(idempotency_key)
+        if previous:
+            return previous
+
+        player = txn.player
+        # Another request may have completed or swapped it while we fetched weather
+        active = player["active_quest"]
+        if not active or active.get("id") != quest.get("id"):
+            return {"error": "No active quest assigned."}
+
+        leveled_up = add_xp(player, xp)
+        txn.post(geobucks_gained, "complete_active_quest",
+                 ref=quest.get("id"), idempotency_key=idempotency_key)
+
+        # Reset quest
+        player["active_quest"] = None
+
+        result = {
+            "status": "completed",
+            "xp_gained": xp,
+            "geobucks_gained": geobucks_gained,
+            "new_level": player["level"],
+            "current_xp": player["xp"],
+            "total_geobucks": player["geobucks"],
+            "leveled_up": leveled_up,
+            "weather": weather,
+            "message": (
+                f"You completed '{quest['place']}' and earned {xp} XP "
+                f"+ {geobucks_gained} GeoBucks!"
+            ),
+            "distance_m": round(distance, 1)
+        }
 
-    return {
-        "status": "completed",
-        "xp_gained": xp,
-        "geobucks_gained": geobucks_gained,
-        "new_level": player["level"],
-        "current_xp": player["xp"],
-        "total_geobucks": player["geobucks"],
-        "leveled_up": leveled_up,
-        "weather": weather,
-        "message": (
-            f"You completed '{quest['place']}' and earned {xp} XP "
-            f"+ {geobucks_gained} GeoBucks!"
-        ),
-        "distance_m": round(distance, 1)
-    }
+    ledger.remember(idempotency_key, result)
+    return result
 
 
 
 @app.get("/check_weather_for_quest")
 def check_weather_for_quest(quest_id: str):
-    global current_public_quests
-
-    quest = next((q for q in current_public_quests if q["id"] == quest_id), None)
+    quest = get_public_quest(quest_id)
     if not quest:
         return {"error": "Quest not found."}
 
@@ -451,7 +1002,7 @@ def check_weather_for_quest(quest_id: str):
     if not result.get("is_okay") and "suggested_quest" in result and result["suggested_quest"]:
         suggested = result["suggested_quest"]
         suggested["id"] = str(uuid4())  # assign new ID
-        current_public_quests.append(suggested)
+        add_public_quests([suggested])
         result["suggested_quest"]["id"] = suggested["id"]
         result["added_to_available_quests"] = True
 
@@ -471,7 +1022,7 @@ def get_shop():
     }
 
 @app.post("/buy_item")
-def buy_item(item_name: str = Query(...)):
+def buy_item(item_name: str = Query(...), idempotency_key: str = Header(None)):
     """Buy virtual items using GeoBucks."""
     shop = {
         "Pamätná minca": 100,
@@ -482,18 +1033,27 @@ def buy_item(item_name: str = Query(...)):
     cost = shop.get(item_name)
     if not cost:
         return {"error": "Item not found"}
-    if player["geobucks"] < cost:
-        return {"error": "Not enough GeoBucks"}
+    with ledger.session(idempotency_key) as txn:
+        previous = ledger.replayed(idempotency_key)
+        if previous:
+            return previous
+
+        player = txn.player
+        if player["geobucks"] < cost:
+            return {"error": "Not enough GeoBucks"}
+
+        txn.post(-cost, "buy_item", ref=item_name, idempotency_key=idempotency_key)
+        result = {
+            "message": f"You purchased {item_name}!",
+            "remaining_geobucks": player["geobucks"]
+        }
 
-    player["geobucks"] -= cost
-    return {
-        "message": f"You purchased {item_name}!",
-        "remaining_geobucks": player["geobucks"]
-    }
+    ledger.remember(idempotency_key, result)
+    return result
 
 
 @app.post("/buy_geobucks")
-def buy_geobucks(amount: int = Query(...)):
+def buy_geobucks(amount: int = Query(...), idempotency_key: str = Header(None)):
     """
     💰 Dummy endpoint to simulate buying GeoBucks with real money.
     In production, this would connect to Stripe, PayPal, or in-app purchases.
@@ -503,18 +1063,38 @@ def buy_geobucks(amount: int = Query(...)):
         return {"error": "Amount must be positive."}
 
     # Simulate purchase confirmation
-    player["geobucks"] += amount
+    with ledger.session(idempotency_key) as txn:
+        previous = ledger.replayed(idempotency_key)
+        if previous:
+            return previous
+
+        player = txn.player
+        txn.post(amount, "buy_geobucks", idempotency_key=idempotency_key)
+        result = {
+            "message": f"Successfully purchased {amount} GeoBucks!",
+            "total_geobucks": player["geobucks"],
+            "note": "This is a simulated purchase. No real money involved."
+        }
 
+    ledger.remember(idempotency_key, result)
+    return result
+
+
+@app.get("/ledger")
+def get_ledger(limit: int = Query(20, ge=1, le=ledger.RECENT_PER_PLAYER)):
+    """Latest GeoBucks ledger entries and the balance they add up to."""
+    player = load_player()
     return {
-        "message": f"Successfully purchased {amount} GeoBucks!",
         "total_geobucks": player["geobucks"],
-        "note": "This is a simulated purchase. No real money involved."
+        "ledger_balance": ledger.balance(player["id"]),
+        "entries": ledger.recent(player["id"], limit),
     }
 
 
 @app.get("/achievements")
 def get_achievements():
     """Return all achievements with player unlock status."""
+    player = load_player()
     unlocked = set(player["achievements"])
     data = [
         {**a, "unlocked": a["id"] in unlocked}
@@ -524,31 +1104,165 @@ def get_achievements():
 
 
 @app.post("/achievements/unlock")
-def unlock_achievement(achievement_id: str = Query(...)):
+def unlock_achievement(achievement_id: str = Query(...), idempotency_key: str = Header(None)):
     """Manually unlock an achievement and reward GeoBucks."""
     ach = next((a for a in achievements if a["id"] == achievement_id), None)
     if not ach:
         return {"error": "Achievement not found."}
 
-    if achievement_id in player["achievements"]:
-        return {"message": f"Achievement '{ach['name']}' already unlocked."}
+    with ledger.session(idempotency_key) as txn:
+        previous = ledger.replayed(idempotency_key)
+        if previous:
+            return previous
+
+        player = txn.player
+        if achievement_id in player["achievements"]:
+            return {"message": f"Achievement '{ach['name']}' already unlocked."}
+
+        # Mark unlocked and reward player
+        player["achievements"].append(achievement_id)
+        txn.post(ach["reward_geobucks"], "achievement",
+                 ref=achievement_id, idempotency_key=idempotency_key)
+        result = {
+            "message": f"Achievement unlocked: {ach['name']}! You earned {ach['reward_geobucks']} GeoBucks.",
+            "total_geobucks": player["geobucks"],
+            "achievement": ach
+        }
 
-    # Mark unlocked and reward player
-    player["achievements"].append(achievement_id)
-    player["geobucks"] += ach["reward_geobucks"]
+    ledger.remember(idempotency_key, result)
+    return result
 
-    return {
-        "message": f"Achievement unlocked: {ach['name']}! You earned {ach['reward_geobucks']} GeoBucks.",
-        "total_geobucks": player["geobucks"],
-        "achievement": ach
-    }
+
+# === LOCATION TRACKING ===
+WS_TRACK_BATCH = 50         # fixes buffered per WebSocket flush
+WS_TRACK_FLUSH_S = 15.0     # ...or seconds, whichever comes first
+
+
+def add_walked_distance(km: float):
+    """Credit walked distance (one player write per flush) and unlock walk_10km."""
+    with ledger.session() as txn:
+        player = txn.player
+        progress = player["progress"]
+        progress["distance_walked"] = round(progress["distance_walked"] + km, 3)
+
+        ach = next(a for a in achievements if a["id"] == "walk_10km")
+        if progress["distance_walked"] >= 10 and ach["id"] not in player["achievements"]:
+            player["achievements"].append(ach["id"])
+            txn.post(ach["reward_geobucks"], "achievement", ref=ach["id"])
+
+
+def track_batch(player_id, fixes):
+    """Ingest a batch and run its latest fix through the geofence engine."""
+    summary = ingest(player_id, fixes, add_walked_distance)
+    if fixes:
+        lat, lon, _, _ = max(fixes, key=lambda f: f[2])
+        events, inside = update_position(player_id, lat, lon, load_player()["active_quest"])
+        summary["geofence_events"] = events
+        summary["inside"] = inside
+    return summary
+
+
+@app.post("/position")
+def report_position(lat: float = Query(...), lon: float = Query(...)):
+    """
+    Single position update → geofence enter/exit events for zone quests
+    (25 m), zones and the active quest (100 m).
+    """
+    player = load_player()
+    events, inside = update_position(player["id"], lat, lon, player["active_quest"])
+    return {"events": events, "inside": inside}
+
+
+@app.post("/track")
+async def track(request: Request):
+    """
+    Ingest a batch of GPS fixes as NDJSON, one {"lat", "lon", "t", "acc"} per line.
+    Returns how much of the batch counted as walked distance.
+    """
+    body = await request.body()
+    try:
+        fixes = parse_ndjson(body)
+    except TrackError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    player_id = load_player()["id"]
+    return await run_in_threadpool(track_batch, player_id, fixes)
+
+
+@app.websocket("/ws/track")
+async def track_stream(ws: WebSocket):
+    """
+    Stream GPS fixes (NDJSON text frames). Fixes are buffered and ingested
+    every WS_TRACK_BATCH fixes or WS_TRACK_FLUSH_S seconds; each flush is
+    acknowledged with the batch summary and geofence events.
+    """
+    await ws.accept()
+    player_id = load_player()["id"]
+    buffer = []
+    last_flush = time.monotonic()
+
+    async def flush():
+        nonlocal buffer, last_flush
+        batch, buffer = buffer, []
+        last_flush = time.monotonic()
+        return await run_in_threadpool(track_batch, player_id, batch)
+
+    try:
+        while True:
+            try:
+                text = await asyncio.wait_for(ws.receive_text(), timeout=WS_TRACK_FLUSH_S)
+                buffer.extend(parse_ndjson(text.encode("utf-8")))
+            except asyncio.TimeoutError:
+                pass
+            except TrackError as e:
+                await ws.send_json({"error": str(e)})
+                continue
+
+            if buffer and (len(buffer) >= WS_TRACK_BATCH
+                           or time.monotonic() - last_flush >= WS_TRACK_FLUSH_S):
+                await ws.send_json(await flush())
+    except WebSocketDisconnect:
+        if buffer:
+            await flush()
+
+
+# === PUSH CHANNEL ===
+@app.get("/events")
+async def player_events():
+    """
+    Server-sent events replacing polling of /player, /get_active_quest and
+    /get_available_quests: a snapshot first, then only the changed fields.
+    """
+    async def stream():
+        async for msg in player_updates():
+            if msg is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {msg['type']}\ndata: {json.dumps(msg)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/ws/player")
+async def player_socket(ws: WebSocket):
+    """Same messages as /events over a WebSocket (keep-alives as {"type": "ping"})."""
+    await ws.accept()
+    updates = player_updates()
+    try:
+        async for msg in updates:
+            await ws.send_json(msg if msg is not None else {"type": "ping"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await updates.aclose()
 
 
 # === LEADERBOARD ===
 @app.get("/leaderboard")
 def get_leaderboard():
     """Returns a dummy leaderboard including the current player."""
-    global player
+    player = load_player()
 
     dummy_leaderboard = [
         {"name": "ExplorerA", "level": 12, "xp": 480, "geobucks": 620},
@@ -1,53 +1,81 @@
-import requests, os, time
+import os, time
+from services import metrics, upstream
+from services.store import store
+
+CDSE_TOKEN_URL = os.getenv(
+    "CDSE_TOKEN_URL",
+    "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+)
+
+# Refresh a little before the real expiry so in-flight calls never carry a dead token.
+EXPIRY_MARGIN = 30
+
+
+def _client_id():
+    return os.getenv("COPERNICUS_CLIENT_ID", "cdse-public")
+
+
+def _cached_token():
+    """The token cache is shared by all workers through services/store.py."""
+    cache = store.get("tokens", "copernicus") or {}
+    if cache.get("access_token") and time.time() < cache.get("expires_at", 0):
+        return cache["access_token"]
+    return None
+
+
+def _save_token(data, refresh_token=None):
+    store.set("tokens", "copernicus", {
+        "access_token": data["access_token"],
+        "refresh_token": data.get("refresh_token", refresh_token),
+        "expires_at": time.time() + int(data.get("expires_in", 900)) - EXPIRY_MARGIN
+    })
+    return data["access_token"]
 
-TOKEN_CACHE = {"access_token": None, "expires_at": 0, "refresh_token": None}
 
 def get_copernicus_token():
     """Get or refresh Copernicus Data Space access token."""
-    if TOKEN_CACHE["access_token"] and time.time() < TOKEN_CACHE["expires_at"]:
-        return TOKEN_CACHE["access_token"]
+    token = _cached_token()
+    metrics.cache_lookup("copernicus_token", token is not None)
+    if token:
+        return token
+
+    # Only one thread/worker talks to the identity server at a time
+    with store.lock("copernicus_token"):
+        token = _cached_token()
+        if token:
+            return token
+
+        refresh_token = (store.get("tokens", "copernicus") or {}).get("refresh_token")
 
-    refresh_token = TOKEN_CACHE.get("refresh_token")
-    auth_url = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+        # ✅ Try to refresh existing token
+        if refresh_token:
+            r = upstream.post(
+                "cdse_auth",
+                CDSE_TOKEN_URL,
+                data={
+                    "grant_type": "refresh_token",
+                    "client_id": _client_id(),
+                    "refresh_token": refresh_token,
+                },
+                timeout=15,
+            )
+            if r.ok:
+                return _save_token(r.json(), refresh_token)
 
-    # ✅ Try to refresh existing token
-    if refresh_token:
-        r = requests.post(
-            auth_url,
+        # 🆕 Get new token with username/password
+        r = upstream.post(
+            "cdse_auth",
+            CDSE_TOKEN_URL,
             data={
-                "grant_type": "refresh_token",
-                "client_id": os.getenv("COPERNICUS_CLIENT_ID"),
-                "refresh_token": refresh_token,
+                "grant_type": "password",
+                "client_id": _client_id(),
+                "username": os.getenv("COPERNICUS_USERNAME") or os.getenv("COPERNICUS_USER"),
+                "password": os.getenv("COPERNICUS_PASSWORD") or os.getenv("COPERNICUS_PASS"),
             },
+            timeout=15,
         )
-        if r.ok:
-            data = r.json()
-            TOKEN_CACHE.update({
-                "access_token": data["access_token"],
-                "refresh_token": data.get("refresh_token", refresh_token),
-                "expires_at": time.time() + int(data.get("expires_in", 900))
-            })
-            return data["access_token"]
-
-    # 🆕 Get new token with username/password
-    r = requests.post(
-        auth_url,
-        data={
-            "grant_type": "password",
-            "client_id": os.getenv("COPERNICUS_CLIENT_ID"),
-            "username": os.getenv("COPERNICUS_USERNAME"),
-            "password": os.getenv("COPERNICUS_PASSWORD"),
-        },
-    )
-
-    if not r.ok:
-        raise Exception(f"Copernicus auth failed: {r.text}")
-
-    data = r.json()
-    TOKEN_CACHE.update({
-        "access_token": data["access_token"],
-        "refresh_token": data.get("refresh_token"),
-        "expires_at": time.time() + int(data.get("expires_in", 900))
-    })
 
-    return data["access_token"]
+        if not r.ok:
+            raise Exception(f"Copernicus auth failed: {r.text}")
+
+        return _save_token(r.json())
@@ -0,0 +1,72 @@
+"""
+On-disk fixture store for upstream traffic (record / replay).
+
+Controlled by env vars:
+  FIXTURE_MODE   off (default) | record | replay
+  FIXTURE_DIR    where fixtures live (default: backend/fixtures)
+  FIXTURE_DELAY  original (default) | none — replay timing
+
+Every fixture is <dir>/<service>/<key>.json (metadata) plus <key>.bin (raw body).
+"""
+import hashlib
+import json
+import os
+import time
+
+FIXTURE_MODE = os.getenv("FIXTURE_MODE", "off").lower()
+FIXTURE_DIR = os.getenv(
+    "FIXTURE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures")
+)
+FIXTURE_DELAY = os.getenv("FIXTURE_DELAY", "original").lower()
+
+
+class FixtureMissing(Exception):
+    """Replay mode was asked for a request that was never recorded."""
+
+
+def recording():
+    return FIXTURE_MODE == "record"
+
+
+def replaying():
+    return FIXTURE_MODE == "replay"
+
+
+def fixture_key(*parts):
+    """Stable hash of the request parts that decide the response."""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _paths(service, key):
+    base = os.path.join(FIXTURE_DIR, service, key)
+    return base + ".json", base + ".bin"
+
+
+def save(service, key, meta: dict, body: bytes):
+    """Write one fixture atomically (tmp file + rename)."""
+    meta_path, body_path = _paths(service, key)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+
+    for path, data in ((body_path, body), (meta_path, json.dumps(meta, indent=2).encode("utf-8"))):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def load(service, key):
+    """Return (meta, body) of a recorded fixture, honouring FIXTURE_DELAY."""
+    meta_path, body_path = _paths(service, key)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            body = f.read()
+    except FileNotFoundError:
+        raise FixtureMissing(f"No {service} fixture for key {key}")
+
+    if FIXTURE_DELAY == "original":
+        time.sleep(meta.get("elapsed", 0))
+    return meta, body
@@ -0,0 +1,107 @@
+"""
+Geofence engine: turns player positions into enter / exit events.
+
+Every zone quest (QR_RADIUS), every zone (its quest spread + ZONE_MARGIN)
+and the player's active quest (ACTIVE_RADIUS) is a circular fence. Fences
+live in a GridIndex, so one position is checked against only the fences
+registered in its grid cell. Exits use a small hysteresis so GPS noise
+at the edge does not flap enter/exit.
+"""
+from services.store import store
+from services.zones import get_catalog
+from utils.calc import haversine
+from utils.grid import GridIndex
+
+QR_RADIUS = 25          # m — same rule as /complete_quest_by_qr
+ACTIVE_RADIUS = 100     # m — same rule as /complete_active_quest
+ZONE_MARGIN = 50        # m around the farthest quest of a zone
+ZONE_MIN_RADIUS = 150   # m
+EXIT_HYSTERESIS = 1.2   # leave only beyond radius * 1.2
+
+_index = {"catalog": None, "grid": None}
+
+
+def _insert(grid, fence_id, lat, lon, radius, ref):
+    # Registered in every cell the exit range (radius * EXIT_HYSTERESIS)
+    # touches, so a player inside the hysteresis band still finds the fence.
+    grid.insert(fence_id, lat, lon, radius * EXIT_HYSTERESIS, (radius, ref))
+
+
+def _build(catalog):
+    """Grid of fence coordinates; names and places are looked up only for hits (_describe)."""
+    grid = GridIndex(cell_deg=0.01)
+    for code, lat, lon, quests in catalog.fence_points():
+        spread = max((haversine(lat, lon, q_lat, q_lon) for _, q_lat, q_lon in quests), default=0)
+        _insert(grid, f"zone:{code}", lat, lon, max(ZONE_MIN_RADIUS, spread + ZONE_MARGIN), ("zone", code))
+        for quest_id, q_lat, q_lon in quests:
+            _insert(grid, f"quest:{quest_id}", q_lat, q_lon, QR_RADIUS, ("quest", quest_id))
+    return grid
+
+
+def _describe(catalog, ref):
+    kind, key = ref
+    if kind == "zone":
+        zone = catalog.by_code.get(key)
+        return zone and {"kind": "zone", "code": key, "name": zone["name"]}
+    zone, quest = catalog.by_quest_id.get(key, (None, None))
+    return quest and {"kind": "quest", "quest_id": key, "zone": zone["code"], "place": quest["place"]}
+
+
+def get_index():
+    """(catalog, fence grid), the grid rebuilt when the zone catalog is reloaded."""
+    catalog = get_catalog()
+    if _index["catalog"] is not catalog:
+        _index["grid"] = _build(catalog)
+        _index["catalog"] = catalog
+    return catalog, _index["grid"]
+
+
+def fences_at(lat, lon, active_quest=None):
+    """{fence_id: (distance_m, radius_m, data)} for every fence within exit range."""
+    catalog, grid = get_index()
+    found = {}
+    for fence_id in grid.at(lat, lon):
+        f_lat, f_lon, reach, (radius, ref) = grid.items[fence_id]
+        distance = haversine(lat, lon, f_lat, f_lon)
+        if distance <= reach:
+            data = _describe(catalog, ref)
+            if data:
+                found[fence_id] = (distance, radius, data)
+
+    if active_quest and active_quest.get("lat") is not None:
+        distance = haversine(lat, lon, active_quest["lat"], active_quest["lon"])
+        if distance <= ACTIVE_RADIUS * EXIT_HYSTERESIS:
+            found[f"active:{active_quest.get('id')}"] = (distance, ACTIVE_RADIUS, {
+                "kind": "active_quest", "quest_id": active_quest.get("id"),
+                "place": active_quest.get("place"),
+            })
+    return found
+
+
+def update_position(player_id, lat, lon, active_quest=None):
+    """
+    Feed one position. Returns (events, inside) where events are the enter /
+    exit transitions since the previous position of this player.
+    """
+    nearby = fences_at(lat, lon, active_quest)
+    key = str(player_id)
+
+    with store.lock(f"geofence:{key}"):
+        previous = set(store.get("geofence", key) or [])
+        inside = set()
+        events = []
+
+        for fence_id, (distance, radius, data) in nearby.items():
+            if distance <= radius or fence_id in previous:
+                inside.add(fence_id)
+            if fence_id not in previous and distance <= radius:
+                events.append({"event": "enter", "fence": fence_id,
+                               "distance_m": round(distance, 1), **data})
+
+        for fence_id in previous - inside:
+            events.append({"event": "exit", "fence": fence_id})
+
+        if inside != previous:
+            store.set("geofence", key, sorted(inside))
+
+    return events, sorted(inside)
@@ -0,0 +1,202 @@
+"""
+LLM call governor: every OpenAI call made through services/llm.py takes a
+slot here first.
+
+  - request and token budgets: two token buckets (LLM_RPM, LLM_TPM);
+    token cost is estimated up front and corrected with the real usage
+  - bounded concurrency: at most LLM_MAX_CONCURRENCY calls in flight
+  - priority classes: waiting interactive calls are always granted before
+    background ones (see `background()`)
+  - backpressure: at most LLM_MAX_QUEUE waiters per class and a maximum
+    wait per class; beyond that LLMBusy is raised at once, so callers fall
+    back instead of piling up behind the provider's rate limit
+  - after a 429 the governor pauses all grants for the Retry-After time
+
+Budgets are per process. LLM_RPM / LLM_TPM are the limits for the whole
+deployment and are divided by WEB_CONCURRENCY (the uvicorn worker count),
+so N workers together stay within them. Each worker's share is fixed:
+an idle worker's budget is not lent to a busy one.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from services import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # per worker
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_RPM", "500")) / WORKERS
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TPM", "200000")) / WORKERS
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+MAX_WAIT_S = {
+    INTERACTIVE: float(os.getenv("LLM_MAX_WAIT_S", "10")),
+    BACKGROUND: float(os.getenv("LLM_BACKGROUND_MAX_WAIT_S", "120")),
+}
+COMPLETION_ESTIMATE = 300  # tokens reserved for the answer before usage is known
+
+QUEUE_WAIT = metrics.Histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for a governor slot.", ("priority",)
+)
+REJECTED = metrics.Counter(
+    "llm_rejected_total", "LLM calls refused by the governor (queue_full / timeout).",
+    ("priority", "reason")
+)
+RATE_LIMITED = metrics.Counter(
+    "llm_rate_limited_total", "429 responses from the LLM provider."
+)
+
+_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+class LLMBusy(RuntimeError):
+    """The governor refused the call (queue full or waited too long)."""
+
+
+class TokenBucket:
+    """`rate` units per second, up to `capacity`. May go negative (debt) on corrections."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` is available (0 if it is)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class Governor:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.active = 0
+        self.paused_until = 0.0
+        self._waiting = []  # heap of (priority, seq)
+        self._queued = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _acquire(self, priority, est_tokens):
+        name = PRIORITY_NAMES[priority]
+        with self._cond:
+            if self._queued[priority] >= MAX_QUEUE:
+                REJECTED.inc(priority=name, reason="queue_full")
+                raise LLMBusy(f"LLM queue full ({name})")
+
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            self._queued[priority] += 1
+            start = time.monotonic()
+            deadline = start + MAX_WAIT_S[priority]
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = None
+                    if self._waiting[0] == ticket and self.active < self.max_concurrency:
+                        delay = max(
+                            self.paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(est_tokens, now),
+                        )
+                        if delay <= 0:
+                            break
+                    if now >= deadline:
+                        REJECTED.inc(priority=name, reason="timeout")
+                        raise LLMBusy(f"LLM governor wait exceeded ({name})")
+                    self._cond.wait(min(deadline - now, delay) if delay else deadline - now)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._queued[priority] -= 1
+                self._cond.notify_all()
+
+            self.requests.take(1)
+            self.tokens.take(est_tokens)
+            self.active += 1
+        QUEUE_WAIT.observe(time.monotonic() - start, priority=name)
+
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, prompt, completion_estimate=COMPLETION_ESTIMATE):
+        """
+        Hold one call slot at the current priority. Yields a callback
+        `settle(used_tokens)` to correct the token budget with real usage.
+        """
+        estimate = len(prompt) // 4 + completion_estimate
+        self._acquire(_priority.get(), estimate)
+
+        def settle(used_tokens):
+            with self._cond:
+                self.tokens.take(used_tokens - estimate)
+
+        try:
+            yield settle
+        finally:
+            self._release()
+
+    def rate_limited(self, retry_after=None):
+        """Provider said 429: hold every grant for `retry_after` seconds."""
+        RATE_LIMITED.inc()
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or 1.0))
+            self._cond.notify_all()
+
+    def saturated(self):
+        """True when a new interactive call would have to wait (paused, queued or out of budget)."""
+        with self._cond:
+            now = time.monotonic()
+            return (now < self.paused_until
+                    or self._queued[INTERACTIVE] > 0
+                    or self.active >= self.max_concurrency
+                    or self.requests.wait_time(1, now) > 0)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self.active,
+                "queued": {PRIORITY_NAMES[p]: n for p, n in self._queued.items()},
+                "request_budget": round(self.requests.level, 1),
+                "token_budget": round(self.tokens.level),
+                "paused_s": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            }
+
+
+governor = Governor()
+
+metrics.Gauge("llm_in_flight", "LLM calls currently holding a governor slot.", (),
+              lambda: {(): governor.active})
+metrics.Gauge("llm_queued", "LLM calls waiting for a governor slot.", ("priority",),
+              lambda: {(PRIORITY_NAMES[p],): n for p, n in governor._queued.items()})
+
+
+@contextmanager
+def background():
+    """LLM calls made inside this block queue behind interactive ones."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
@@ -0,0 +1,155 @@
+"""
+Demand heatmap and pre-warming of hot areas.
+
+/generate_quest origins are counted per area (the ~1 km cell that also
+keys the POI cache, see services/places.py) with exponential decay
+(HEATMAP_HALF_LIFE_H). Counts are kept in memory per worker and merged
+into the shared map every HEATMAP_FLUSH_S, so a request only touches a
+local dict. A background job re-runs the quest pipeline for the
+hottest areas every PREWARM_INTERVAL_S, so POIs, weather, air quality and
+LLM quests are already cached when the first player of the day arrives.
+LLM calls of the job run at background priority (services/governor.py).
+
+With several workers only the one holding the "prewarm" lease runs a cycle.
+"""
+import atexit
+import os
+import threading
+import time
+
+from services import metrics
+from services.governor import background
+from services.places import area_center
+from services.store import store
+
+HALF_LIFE_S = float(os.getenv("HEATMAP_HALF_LIFE_H", "12")) * 3600
+MAX_AREAS = 2000
+FLUSH_S = float(os.getenv("HEATMAP_FLUSH_S", "5"))
+PREWARM_INTERVAL_S = float(os.getenv("PREWARM_INTERVAL_S", "600"))
+PREWARM_AREAS = int(os.getenv("PREWARM_AREAS", "5"))
+PREWARM_MIN_SCORE = float(os.getenv("PREWARM_MIN_SCORE", "2"))
+PREWARM_HOURS = os.getenv("PREWARM_HOURS", "0-24")  # local hours the job runs, e.g. "6-20"
+
+PREWARMED = metrics.Counter(
+    "prewarm_areas_total", "Hot areas pre-warmed by the background job (ok / error).",
+    ("result",)
+)
+
+
+def _decayed(score, updated, now):
+    return score * 0.5 ** ((now - updated) / HALF_LIFE_S)
+
+
+# === HEATMAP ===
+_pending = {}  # area key → (score, updated) counted by this worker since the last flush
+_pending_lock = threading.Lock()
+_flusher = {"thread": None}
+
+
+def record(lat, lon, weight=1.0):
+    """Count one request at (lat, lon); merged into the shared map by flush()."""
+    key = "%s,%s" % area_center(lat, lon)
+    now = time.time()
+    with _pending_lock:
+        score, updated = _pending.get(key, (0.0, now))
+        _pending[key] = (_decayed(score, updated, now) + weight, now)
+        if _flusher["thread"] is None:
+            _flusher["thread"] = threading.Thread(target=_flush_loop, name="heatmap-flush", daemon=True)
+            _flusher["thread"].start()
+
+
+def flush():
+    """Merge this worker's counts into the shared map (one read-modify-write)."""
+    with _pending_lock:
+        if not _pending:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+
+    now = time.time()
+    with store.lock("heatmap"):
+        areas = store.get("heatmap", "areas") or {}
+        for key, (score, updated) in pending.items():
+            old = areas.get(key)
+            total = _decayed(score, updated, now) + (_decayed(*old, now) if old else 0.0)
+            areas[key] = (total, now)
+        if len(areas) > MAX_AREAS:
+            coldest = sorted(areas, key=lambda k: _decayed(*areas[k], now))[:len(areas) - MAX_AREAS]
+            for k in coldest:
+                del areas[k]
+        store.set("heatmap", "areas", areas)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_S)
+        try:
+            flush()
+        except Exception as e:
+            print("Heatmap flush error:", e)
+            metrics.SERVICE_ERRORS.inc(function="heatmap_flush")
+
+
+atexit.register(flush)
+
+
+def hottest(limit=PREWARM_AREAS, min_score=0.0):
+    """[(lat, lon, score)] of the hottest areas, decayed to now."""
+    flush()
+    now = time.time()
+    areas = store.get("heatmap", "areas") or {}
+    scored = []
+    for key, (score, updated) in areas.items():
+        score = _decayed(score, updated, now)
+        if score >= min_score:
+            lat, lon = (float(v) for v in key.split(","))
+            scored.append((lat, lon, round(score, 3)))
+    scored.sort(key=lambda a: a[2], reverse=True)
+    return scored[:limit]
+
+
+# === PRE-WARMING ===
+def _in_hours(hour):
+    for span in PREWARM_HOURS.split(","):
+        start, _, end = span.partition("-")
+        if int(start) <= hour < int(end or 24):
+            return True
+    return False
+
+
+def _acquire_lease():
+    """True for the one worker that should run this cycle."""
+    with store.lock("prewarm"):
+        if store.get("prewarm", "lease"):
+            return False
+        store.set("prewarm", "lease", os.getpid(), ttl=PREWARM_INTERVAL_S * 0.9)
+        return True
+
+
+def prewarm_once(warm_area):
+    """Run `warm_area(lat, lon)` for the hottest areas. Returns the areas warmed."""
+    warmed = []
+    with background():
+        for lat, lon, score in hottest(PREWARM_AREAS, PREWARM_MIN_SCORE):
+            try:
+                warm_area(lat, lon)
+                PREWARMED.inc(result="ok")
+                warmed.append((lat, lon, score))
+            except Exception as e:
+                print("Prewarm error:", e)
+                metrics.SERVICE_ERRORS.inc(function="prewarm")
+                PREWARMED.inc(result="error")
+    return warmed
+
+
+def start(warm_area):
+    """Start the pre-warm loop in a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(PREWARM_INTERVAL_S)
+            if _in_hours(time.localtime().tm_hour) and _acquire_lease():
+                prewarm_once(warm_area)
+
+    thread = threading.Thread(target=loop, name="prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,131 @@
+"""
+Walking itinerary planner: best order to do a set of quests from the
+player's position.
+
+The stops get a value from the ranking terms in services.logic (weather-
+adjusted reward, weather fit for outdoor quests). Edge cost is the walking
+distance divided by sqrt(value_i * value_j), so routes lean towards
+valuable stops while the matrix stays symmetric for 2-opt.
+
+  1. distance matrix with vectorized haversine (player = node 0)
+  2. nearest-neighbour open path from the player
+  3. 2-opt improvement, one vectorized scan per segment start, until no
+     move improves or the time budget is spent
+"""
+import time
+
+from services.logic import score_quests
+from utils.calc import haversine_vec
+
+TIME_BUDGET_S = 0.25
+MAX_STOPS = 500
+
+
+def distance_matrix(lats, lons):
+    """n x n metres between all points (vectorized haversine)."""
+    import numpy as np
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    return haversine_vec(lats[:, None], lons[:, None], lats[None, :], lons[None, :])
+
+
+def stop_values(quests):
+    """Per-stop value in [0.5, 1]: weather-adjusted reward x weather fit."""
+    _, components = score_quests(quests)
+    return 0.5 + 0.5 * components["reward"] * components["weather"]
+
+
+def nearest_neighbour(cost):
+    """Open path from node 0 always taking the cheapest unvisited node."""
+    import numpy as np
+
+    n = len(cost)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    route = [0]
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, cost[route[-1]])
+        nxt = int(np.argmin(row))
+        visited[nxt] = True
+        route.append(nxt)
+    return route
+
+
+def two_opt(route, cost, deadline):
+    """
+    Improve an open path with a fixed start by reversing segments
+    route[i..j]. For each i all j are evaluated at once. Returns
+    (route, moves applied).
+    """
+    import numpy as np
+
+    route = np.asarray(route)
+    n = len(route)
+    moves = 0
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, n - 1):
+            a, b = route[i - 1], route[i]
+            js = np.arange(i + 1, n)
+            c = route[js]
+            nxt = np.append(route[i + 2:], -1)  # node after j, -1 at the path end
+            has_next = nxt >= 0
+            after = np.where(has_next, nxt, 0)
+            # a-b ... c-d  →  a-c ... b-d  (no d-edge at the end of an open path)
+            delta = (cost[a, c] - cost[a, b]
+                     + np.where(has_next, cost[b, after] - cost[c, after], 0.0))
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = js[best]
+                route[i:j + 1] = route[i:j + 1][::-1].copy()
+                moves += 1
+                improved = True
+            if time.perf_counter() >= deadline:
+                break
+    return route.tolist(), moves
+
+
+def plan(start, quests, max_m=None, time_budget=TIME_BUDGET_S):
+    """
+    Order `quests` (dicts with lat, lon, reward, ...) from `start` = (lat, lon).
+    With `max_m` the route stops before the walk would exceed it.
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    deadline = started + time_budget
+
+    lats = [start[0]] + [q["lat"] for q in quests]
+    lons = [start[1]] + [q["lon"] for q in quests]
+    dist = distance_matrix(lats, lons)
+    values = np.concatenate([[1.0], stop_values(quests)])
+    cost = dist / np.sqrt(np.outer(values, values))
+
+    route = nearest_neighbour(cost)
+    route, moves = two_opt(route, cost, deadline)
+
+    stops = []
+    walked = 0.0
+    skipped = []
+    for prev, node in zip(route, route[1:]):
+        leg = float(dist[prev, node])
+        if max_m is not None and (skipped or walked + leg > max_m):
+            skipped.append(quests[node - 1])
+            continue
+        walked += leg
+        stops.append({
+            "quest": quests[node - 1],
+            "leg_m": round(leg, 1),
+            "cumulative_m": round(walked, 1),
+            "value": round(float(values[node]), 3),
+        })
+
+    return {
+        "stops": stops,
+        "skipped": skipped,
+        "total_m": round(walked, 1),
+        "two_opt_moves": moves,
+        "solve_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -0,0 +1,300 @@
+"""
+Append-only GeoBucks ledger.
+
+Every balance change is one JSON line in LEDGER_PATH:
+  {"txn": id, "player": id, "delta": +/-n, "balance": after, "reason", "ref",
+   "idempotency_key", "ts"}
+player["geobucks"] stays the materialized balance and is updated in the
+same player_session as the entry is queued, so entries of one player are
+written in balance order. The first entry of a player is an
+"opening_balance" so the ledger always sums to the balance. The store
+remembers that the ledger was checked against the player ("ledger_opened");
+when the store lost that (memory backend restarted, state DB removed) the
+player may have been reset while the ledger kept its balance, so the next
+post writes an "adjustment" entry for the difference first.
+
+Writes go through a group-commit writer thread: entries queued while the
+previous batch is being fsync'ed are written with one write() + one
+fsync(). Callers wait for their batch (`commit(txn)`) after releasing the
+player lock, so concurrent purchases and completions share fsyncs instead
+of queueing behind each other.
+
+Idempotency keys map to the stored response for IDEMPOTENCY_TTL seconds
+(shared store, so retries may hit any worker). The response is stored
+only after its entries are durable; until then the key is held "in
+flight" so a concurrent retry is refused (InFlight) instead of applied
+twice.
+
+The ledger is the source of truth for GeoBucks. Endpoints mutate the
+player in a ledger session (`with session() as txn:`); if the session's
+entries fail to write, the session is rolled back: the player is put
+back as it was before the session when nobody changed it since,
+otherwise only the GeoBucks of the failed entries are taken back out of
+the balance. The key is released, so the client's retry runs again. A
+commit that times out is not rolled back (the entry is still queued and
+will be written); its key stays held for IN_FLIGHT_TTL seconds.
+"""
+import copy
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from uuid import uuid4
+
+from services import metrics
+from services.state import player_session
+from services.store import store
+
+LEDGER_PATH = os.getenv("LEDGER_PATH", "/tmp/geoquest-ledger.jsonl")
+LEDGER_FSYNC = os.getenv("LEDGER_FSYNC", "1") != "0"
+COMMIT_WINDOW_S = float(os.getenv("LEDGER_COMMIT_WINDOW_MS", "1")) / 1000
+MAX_BATCH = 1024
+COMMIT_TIMEOUT_S = 10
+IDEMPOTENCY_TTL = 24 * 3600
+IN_FLIGHT_TTL = 6 * COMMIT_TIMEOUT_S
+RECENT_PER_PLAYER = 50
+
+COMMIT_LATENCY = metrics.Histogram(
+    "ledger_commit_duration_seconds", "Time from queuing a ledger entry until it is durable."
+)
+COMMIT_BATCH = metrics.Histogram(
+    "ledger_commit_batch_size", "Ledger entries written per fsync.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+
+class LedgerError(RuntimeError):
+    pass
+
+
+class InFlight(LedgerError):
+    """A request with the same idempotency key is still being committed."""
+
+
+class _Pending:
+    __slots__ = ("line", "delta", "queued_at", "done", "error")
+
+    def __init__(self, line, delta=0):
+        self.line = line
+        self.delta = delta
+        self.queued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitWriter:
+    """Single background thread appending queued lines, one fsync per batch."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, line, delta=0):
+        pending = _Pending(line, delta)
+        with self._cond:
+            self._queue.append(pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return pending
+
+    def _run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            if COMMIT_WINDOW_S:
+                time.sleep(COMMIT_WINDOW_S)  # let concurrent writers join the batch
+            with self._cond:
+                batch, self._queue = self._queue[:MAX_BATCH], self._queue[MAX_BATCH:]
+
+            error = None
+            try:
+                data = "".join(p.line for p in batch).encode("utf-8")
+                fcntl.flock(fd, fcntl.LOCK_EX)  # other workers append to the same file
+                try:
+                    os.write(fd, data)
+                    if LEDGER_FSYNC:
+                        os.fsync(fd)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            except OSError as e:
+                print("Ledger write error:", e)
+                metrics.SERVICE_ERRORS.inc(function="ledger_commit")
+                error = e
+
+            COMMIT_BATCH.observe(len(batch))
+            now = time.perf_counter()
+            for p in batch:
+                p.error = error
+                COMMIT_LATENCY.observe(now - p.queued_at)
+                p.done.set()
+
+
+_writer = GroupCommitWriter(LEDGER_PATH)
+
+
+# === WRITES ===
+def post(player, delta, reason, ref=None, idempotency_key=None):
+    """
+    Apply `delta` GeoBucks to `player` and queue the ledger entry. Call inside
+    player_session(); then call commit() on the result after the session.
+    Endpoints use session() / Transaction.post(), which also roll back.
+    """
+    key = str(player["id"])
+    if not store.get("ledger_opened", key):
+        recorded = balance(player["id"])
+        if recorded is None:
+            _submit(player["id"], player["geobucks"], player["geobucks"], "opening_balance")
+        elif recorded != player["geobucks"]:
+            print(f"Ledger balance {recorded} != player balance {player['geobucks']}, adjusting")
+            _submit(player["id"], player["geobucks"] - recorded, player["geobucks"], "adjustment")
+        store.set("ledger_opened", key, True)
+
+    player["geobucks"] += delta
+    return _submit(player["id"], delta, player["geobucks"], reason, ref, idempotency_key)
+
+
+def _submit(player_id, delta, balance, reason, ref=None, idempotency_key=None):
+    entry = {
+        "txn": uuid4().hex,
+        "player": player_id,
+        "delta": delta,
+        "balance": balance,
+        "reason": reason,
+        "ref": ref,
+        "idempotency_key": idempotency_key,
+        "ts": round(time.time(), 3),
+    }
+    return _writer.submit(json.dumps(entry, ensure_ascii=False) + "\n", delta)
+
+
+def commit(*pending):
+    """Block until the given entries are durable (raises LedgerError on failure)."""
+    for p in pending:
+        if p is None:
+            continue
+        if not p.done.wait(COMMIT_TIMEOUT_S):
+            raise LedgerError("Ledger commit timed out")
+        if p.error:
+            raise LedgerError(f"Ledger write failed: {p.error}")
+
+
+class Transaction:
+    """Ledger entries and idempotency keys of one ledger session."""
+
+    def __init__(self, player):
+        self.player = player
+        self.pending = []
+        self.keys = []
+
+    def post(self, delta, reason, ref=None, idempotency_key=None):
+        """post() for the session's player; the key is held until remember()."""
+        self.pending.append(post(self.player, delta, reason, ref, idempotency_key))
+        if idempotency_key:
+            store.set("idempotency_in_flight", idempotency_key, True, ttl=IN_FLIGHT_TTL)
+            self.keys.append(idempotency_key)
+
+
+@contextmanager
+def session(*idempotency_keys):
+    """
+    player_session() whose ledger entries are committed when it ends. Raises
+    InFlight if one of the keys is still being committed by another request,
+    and LedgerError (after rolling the session back) if the entries could
+    not be written. Call remember() only after the session.
+    """
+    with player_session() as player:
+        for key in idempotency_keys:
+            if in_flight(key):
+                raise InFlight("A request with this Idempotency-Key is still being processed")
+        before = copy.deepcopy(player)
+        txn = Transaction(player)
+        yield txn
+        after = copy.deepcopy(player)
+
+    try:
+        commit(*txn.pending)
+    except LedgerError:
+        if all(p.done.is_set() for p in txn.pending):
+            _roll_back(txn, before, after)
+        raise
+
+
+def _roll_back(txn, before, after):
+    failed = [p for p in txn.pending if p.error]
+    with player_session() as player:
+        if player == after:
+            player.clear()
+            player.update(before)
+        else:
+            player["geobucks"] -= sum(p.delta for p in failed)
+    # The opening entry may have been in the failed batch too
+    store.delete("ledger_opened", str(before["id"]))
+    for key in txn.keys:
+        store.delete("idempotency_in_flight", key)
+    print(f"Ledger write failed, rolled back {len(failed)} entries")
+
+
+# === IDEMPOTENCY ===
+def replayed(idempotency_key):
+    """Stored response for a key that was already processed, else None."""
+    if not idempotency_key:
+        return None
+    return store.get("idempotency", idempotency_key)
+
+
+def in_flight(idempotency_key):
+    """True while a request with this key is waiting for its ledger commit."""
+    return bool(idempotency_key) and bool(store.get("idempotency_in_flight", idempotency_key))
+
+
+def remember(idempotency_key, response):
+    """Store the response for a key; call after its entries are committed."""
+    if idempotency_key:
+        store.set("idempotency", idempotency_key, response, ttl=IDEMPOTENCY_TTL)
+        store.delete("idempotency_in_flight", idempotency_key)
+
+
+# === MATERIALIZED VIEW ===
+_view = {"offset": 0, "balances": {}, "recent": {}}
+_view_lock = threading.Lock()
+
+
+def _refresh():
+    """Fold entries appended since the last read (by any worker) into the view."""
+    if not os.path.exists(LEDGER_PATH):
+        return
+    with open(LEDGER_PATH, "rb") as f:
+        f.seek(_view["offset"])
+        data = f.read()
+    end = data.rfind(b"\n") + 1  # ignore a partially written last line
+    for line in data[:end].splitlines():
+        entry = json.loads(line)
+        player = str(entry["player"])
+        _view["balances"][player] = entry["balance"]
+        _view["recent"].setdefault(player, deque(maxlen=RECENT_PER_PLAYER)).append(entry)
+    _view["offset"] += end
+
+
+def balance(player_id):
+    """Balance according to the ledger (None if the player has no entries)."""
+    with _view_lock:
+        _refresh()
+        return _view["balances"].get(str(player_id))
+
+
+def recent(player_id, limit=RECENT_PER_PLAYER):
+    """Latest ledger entries of a player, newest first."""
+    with _view_lock:
+        _refresh()
+        entries = list(_view["recent"].get(str(player_id), ()))
+    return entries[::-1][:limit]
@@ -0,0 +1,160 @@
+"""
+Single entry point for OpenAI chat completions made by services/*.
+Adds record / replay, single-flight coalescing of identical prompts and
+the governor (budgets, concurrency, priorities; services/governor.py) on
+top of the openai client; chat_stream() yields tokens as they arrive.
+The openai package is imported on first use, not at module load.
+"""
+import os
+import threading
+import time
+
+from services import fixtures, metrics
+from services.governor import governor
+from utils.singleflight import SingleFlight
+
+DEFAULT_MODEL = "gpt-4o-mini"
+RATE_LIMIT_RETRIES = 2
+
+_client = None
+_client_lock = threading.Lock()
+
+flight = SingleFlight()
+
+
+def get_client():
+    """Create the OpenAI client on first use (honours OPENAI_API_KEY / OPENAI_BASE_URL)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import openai
+                # No SDK retries: 429s and retries go through the governor (_complete)
+                _client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+
+def chat(prompt: str, temperature: float = 0.7, model: str = DEFAULT_MODEL) -> str:
+    """
+    Send a single-message chat completion and return the stripped text.
+    Identical prompts in flight at the same time share one completion.
+    """
+    key = fixtures.fixture_key(model, prompt, temperature)
+    text, shared = flight.do(key, lambda: _complete(key, prompt, temperature, model))
+    if shared:
+        metrics.COALESCED.inc(service="openai")
+    return text
+
+
+def _retry_after(error):
+    """Seconds to back off if `error` is a 429 from the provider, else None."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+def _complete(key, prompt, temperature, model):
+    if fixtures.replaying():
+        _, body = fixtures.load("openai", key)
+        return body.decode("utf-8")
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        with governor.slot(prompt) as settle:
+            start = time.perf_counter()
+            try:
+                res = get_client().chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature
+                )
+            except Exception as e:
+                metrics.UPSTREAM_ERRORS.inc(service="openai")
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                governor.rate_limited(retry_after)
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.LLM_LATENCY.observe(elapsed, model=model)
+            if res.usage:
+                settle(res.usage.total_tokens or 0)
+        break
+    text = res.choices[0].message.content.strip()
+
+    if res.usage:
+        metrics.LLM_TOKENS.inc(res.usage.prompt_tokens or 0, model=model, kind="prompt")
+        metrics.LLM_TOKENS.inc(res.usage.completion_tokens or 0, model=model, kind="completion")
+
+    if fixtures.recording():
+        usage = res.usage.model_dump() if res.usage else None
+        fixtures.save("openai", key, {
+            "service": "openai",
+            "model": model,
+            "temperature": temperature,
+            "elapsed": round(elapsed, 4),
+            "usage": usage,
+        }, text.encode("utf-8"))
+    return text
+
+
+def chat_stream(prompt: str, temperature: float = 0.7, model: str = DEFAULT_MODEL):
+    """
+    Like chat() but yields the text in chunks as the completion streams in.
+    Not coalesced (callers cache the joined text); fixtures use chat()'s key.
+    """
+    key = fixtures.fixture_key(model, prompt, temperature)
+    if fixtures.replaying():
+        _, body = fixtures.load("openai", key)
+        yield body.decode("utf-8")
+        return
+
+    parts = []
+    usage = None
+    with governor.slot(prompt) as settle:
+        start = time.perf_counter()
+        try:
+            stream = get_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        metrics.LLM_FIRST_TOKEN.observe(time.perf_counter() - start, model=model)
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            metrics.UPSTREAM_ERRORS.inc(service="openai")
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                governor.rate_limited(retry_after)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.LLM_LATENCY.observe(elapsed, model=model)
+        if usage:
+            settle(usage.total_tokens or 0)
+
+    if usage:
+        metrics.LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+        metrics.LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+
+    if fixtures.recording():
+        fixtures.save("openai", key, {
+            "service": "openai",
+            "model": model,
+            "temperature": temperature,
+            "elapsed": round(elapsed, 4),
+            "usage": usage.model_dump() if usage else None,
+        }, "".join(parts).strip().encode("utf-8"))
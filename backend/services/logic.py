@@ -1,7 +1,157 @@
-def choose_best_quest(quests):
-    # weathercode < 50 means clear or cloudy, >=50 rain/snow
-    for q in quests:
-        code = q.get("weather", {}).get("weathercode", 0)
-        if code < 50:
-            return q
-    return quests[0]
+"""
+Quest scoring and ranking.
+
+Every candidate gets a score in one vectorized NumPy pass over:
+  distance   exp(-d / DISTANCE_SCALE) from the player (1 when no position)
+  weather    outdoor quests lose points as the weather gets worse
+  air        outdoor quests lose points with poor air quality
+  fit        indoor quests fit bad conditions, outdoor quests good ones
+  reward     base XP * weather multiplier, relative to the best candidate
+The top k are then taken with a heap.
+"""
+import heapq
+import math
+from functools import lru_cache
+
+from utils.calc import haversine_vec
+
+INDOOR_TYPES = {"museum", "church", "restaurant", "hotel"}
+BAD_WEATHER_CODES = {3, 61, 63, 65, 66, 67, 71, 73, 75, 80, 81, 82, 85, 86, 95, 96, 99}
+AIR_QUALITY_SCORES = {"good": 1.0, "moderate": 0.7, "bad": 0.3, "very bad": 0.0}
+UNKNOWN_SCORE = 0.5  # weather / air quality not known yet
+
+DISTANCE_SCALE = 1500.0  # m — score 1/e at 1.5 km
+DEFAULT_WEIGHTS = {"distance": 1.0, "weather": 1.0, "air": 0.5, "fit": 0.75, "reward": 1.0}
+
+
+def get_weather_multiplier(code: int) -> float:
+    """Return reward multiplier based on weather code."""
+    if code in [0, 1, 2]:  # clear / partly cloudy
+        return 1.0
+    if code in [3]:  # overcast
+        return 1.1
+    if code in [45, 48]:  # fog
+        return 1.2
+    if code in [51, 53, 55]:  # drizzle
+        return 1.2
+    if code in [61, 63, 65, 80, 81, 82]:  # rain
+        return 1.3
+    if code in [66, 67]:  # freezing rain
+        return 1.4
+    if code in [71, 73, 75, 85, 86]:  # snow
+        return 1.4
+    if code in [95, 96, 99]:  # thunderstorms
+        return 1.5
+    return 1.0
+
+
+@lru_cache(maxsize=1024)
+def base_xp(reward) -> int:
+    """'40 XP' → 40 (20 when unparsable, as in reward calculation)."""
+    try:
+        return int(str(reward).split()[0])
+    except Exception:
+        return 20
+
+
+def is_indoor(quest) -> bool:
+    setting = quest.get("indoor_outdoor")
+    if setting:
+        return setting == "indoor"
+    return quest.get("type") in INDOOR_TYPES
+
+
+@lru_cache(maxsize=1)
+def _code_tables():
+    """weathercode (0-99) → reward multiplier, and → bad-weather flag."""
+    import numpy as np
+
+    multiplier = np.array([get_weather_multiplier(c) for c in range(100)])
+    bad = np.isin(np.arange(100), sorted(BAD_WEATHER_CODES))
+    return multiplier, bad
+
+
+def _features(quests):
+    """Per-quest columns as arrays; missing weather becomes NaN / unknown."""
+    import numpy as np
+
+    weathers = [q.get("weather") or {} for q in quests]
+    lat = np.fromiter((q["lat"] for q in quests), float, len(quests))
+    lon = np.fromiter((q["lon"] for q in quests), float, len(quests))
+    indoor = np.fromiter((is_indoor(q) for q in quests), bool, len(quests))
+    xp = np.fromiter((base_xp(q.get("reward")) for q in quests), float, len(quests))
+    code = np.fromiter((w.get("weathercode", math.nan) for w in weathers), float, len(quests))
+    air = np.fromiter(
+        (AIR_QUALITY_SCORES.get((w.get("air_quality") or {}).get("status"), UNKNOWN_SCORE) for w in weathers),
+        float, len(quests)
+    )
+    return lat, lon, code, air, indoor, xp
+
+
+def score_quests(quests, lat=None, lon=None, weights=None):
+    """
+    Scores for `quests` (dicts with lat, lon, reward, type / indoor_outdoor
+    and optionally weather). Returns (scores, components) where components
+    maps each term to its per-quest array and includes "distance_m".
+    """
+    import numpy as np
+
+    w = {**DEFAULT_WEIGHTS, **(weights or {})}
+    q_lat, q_lon, code, air, indoor, xp = _features(quests)
+    known = ~np.isnan(code)
+    codes = np.where(known, code, 0).astype(int)
+
+    multiplier_table, bad_table = _code_tables()
+    in_range = (codes >= 0) & (codes < 100)
+    multiplier = np.where(known & in_range, multiplier_table[np.clip(codes, 0, 99)], 1.0)
+    bad = known & in_range & bad_table[np.clip(codes, 0, 99)]
+
+    if lat is None or lon is None:
+        distance_m = np.zeros(len(quests))
+        distance = np.ones(len(quests))
+    else:
+        distance_m = haversine_vec(lat, lon, q_lat, q_lon)
+        distance = np.exp(-distance_m / DISTANCE_SCALE)
+
+    # 1.0 (clear) … 0.0 (thunderstorm, multiplier 1.5); indoor is unaffected
+    weather = np.where(known, 1.0 - (multiplier - 1.0) / 0.5, UNKNOWN_SCORE)
+    weather = np.where(indoor, 1.0, weather)
+    air_score = np.where(indoor, 1.0, air)
+
+    poor_conditions = bad | (air <= AIR_QUALITY_SCORES["bad"])
+    fit = np.where(indoor == poor_conditions, 1.0, 0.0)
+    fit = np.where(known, fit, UNKNOWN_SCORE)
+
+    final_xp = xp * multiplier
+    reward = final_xp / final_xp.max() if len(final_xp) and final_xp.max() > 0 else final_xp
+
+    components = {
+        "distance": distance, "weather": weather, "air": air_score,
+        "fit": fit, "reward": reward,
+    }
+    scores = sum(w[name] * values for name, values in components.items())
+    components["distance_m"] = distance_m
+    return scores, components
+
+
+def rank_quests(quests, lat=None, lon=None, k=5, weights=None):
+    """
+    Top-k quests as a list of (score, quest, breakdown), best first; ties
+    keep the input order. breakdown holds the per-term scores and distance_m for that quest.
+    """
+    if not quests:
+        return []
+    scores, components = score_quests(quests, lat, lon, weights)
+    score_list = scores.tolist()
+    # nlargest with a key is stable: among equal scores the earlier quest wins
+    best = heapq.nlargest(k, range(len(score_list)), key=score_list.__getitem__)
+    return [
+        (score_list[i], quests[i], {name: float(values[i]) for name, values in components.items()})
+        for i in best
+    ]
+
+
+def choose_best_quest(quests, lat=None, lon=None):
+    """Best single quest by the ranking above (first quest when all tie)."""
+    ranked = rank_quests(quests, lat, lon, k=1)
+    return ranked[0][1] if ranked else None
@@ -0,0 +1,247 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+Counters and histograms are keyed by label values; `render()` produces
+the body served by GET /metrics.
+
+Each uvicorn worker has its own registry, and a scrape reaches one
+worker at random. So every worker publishes a snapshot of its values to
+the shared store every PUBLISH_INTERVAL_S (`start_publishing`), and
+`collect()` renders the sum over the live workers: counters, histogram
+series and gauges (in flight / queued) are added up.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted((self.values() if values is None else values).items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read from `fn()` at render time; fn returns {label values tuple: value}."""
+
+    def __init__(self, name, help_text, labelnames, fn):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def values(self):
+        return self.fn()
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted((self.values() if values is None else values).items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels → [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def values(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted((self.values() if values is None else values).items()):
+            for i, bound in enumerate(self.buckets):
+                labels = _label_str(self.labelnames + ("le",), key + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {series[i]}")
+            labels = _label_str(self.labelnames + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            base = _label_str(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+# === METRICS ===
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency per route.",
+    ("method", "route", "status")
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Latency of outgoing calls per upstream service.",
+    ("service", "status")
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total", "Failed outgoing calls (exception or HTTP >= 400) per upstream service.",
+    ("service",)
+)
+SERVICE_ERRORS = Counter(
+    "service_errors_total", "Errors swallowed inside services/* functions.",
+    ("function",)
+)
+COALESCED = Counter(
+    "coalesced_requests_total", "Calls that shared an identical in-flight call instead of sending their own.",
+    ("service",)
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups per cache and result (hit/miss).",
+    ("cache", "result")
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "OpenAI chat completion latency.",
+    ("model",)
+)
+LLM_FIRST_TOKEN = Histogram(
+    "llm_first_token_seconds", "Time to the first streamed token of an OpenAI chat completion.",
+    ("model",)
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "OpenAI tokens used per model and kind (prompt/completion).",
+    ("model", "kind")
+)
+FALLBACKS = Counter(
+    "fallback_total", "How often a code path fell back to a canned/default answer.",
+    ("path",)
+)
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _cache_ratio_lines(values):
+    totals = {}
+    for (cache, result), value in values.items():
+        hits, total = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (value if result == "hit" else 0), total + value)
+
+    lines = [
+        "# HELP cache_hit_ratio Share of cache lookups that were hits.",
+        "# TYPE cache_hit_ratio gauge",
+    ]
+    for cache, (hits, total) in sorted(totals.items()):
+        lines.append(f'cache_hit_ratio{{cache="{cache}"}} {round(hits / total, 4) if total else 0}')
+    return lines
+
+
+def render(snapshots=None) -> str:
+    """Exposition of this process's metrics, or of the sum of `snapshots`."""
+    values = _merge(snapshots) if snapshots is not None else {m.name: m.values() for m in REGISTRY}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(values.get(metric.name, {})))
+    lines.extend(_cache_ratio_lines(values.get(CACHE_REQUESTS.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+# === MULTI-WORKER ===
+PUBLISH_INTERVAL_S = float(os.getenv("METRICS_PUBLISH_INTERVAL_S", "5"))
+
+
+def snapshot():
+    """This process's values, JSON-serializable: {name: [[label values], value], ...]}."""
+    return {m.name: [[list(k), v] for k, v in m.values().items()] for m in REGISTRY}
+
+
+def _merge(snapshots):
+    """{name: {label values: value}} summed over snapshots (histogram series element-wise)."""
+    merged = {}
+    for snap in snapshots:
+        for name, series in snap.items():
+            target = merged.setdefault(name, {})
+            for key, value in series:
+                key = tuple(key)
+                if key not in target:
+                    target[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target[key] = [a + b for a, b in zip(target[key], value)]
+                else:
+                    target[key] += value
+    return merged
+
+
+def publish(store):
+    store.set("metrics", str(os.getpid()), snapshot(), ttl=3 * PUBLISH_INTERVAL_S)
+
+
+def start_publishing(store):
+    """Publish this worker's snapshot every PUBLISH_INTERVAL_S (background thread)."""
+    def loop():
+        while True:
+            try:
+                publish(store)
+            except Exception as e:
+                print("Metrics publish error:", e)
+            time.sleep(PUBLISH_INTERVAL_S)
+
+    threading.Thread(target=loop, name="metrics-publish", daemon=True).start()
+
+
+def collect(store):
+    """Exposition summed over every live worker (this one freshly published)."""
+    publish(store)
+    return render(list(store.items("metrics").values()))
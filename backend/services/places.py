@@ -1,26 +1,52 @@
-import requests
+import os
+from services import metrics, upstream
+from services.store import cached
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+
+# POIs change rarely: cache per ~1 km area (coordinates rounded to 2 decimals);
+# the query is made around the area centre so every point in it shares one answer.
+PLACES_TTL = int(os.getenv("PLACES_TTL", "86400"))
+AREA_DECIMALS = 2
+# OSM tags kept per place for template quests (services/quest_templates.py)
+QUEST_TAGS = ("historic", "amenity", "leisure", "description", "description:en",
+              "start_date", "architect", "artist_name", "heritage", "ele")
+
+
+def area_center(lat, lon):
+    return round(float(lat), AREA_DECIMALS), round(float(lon), AREA_DECIMALS)
+
 
 def get_nearby_places(lat, lon):
+    lat, lon = area_center(lat, lon)
+    try:
+        return cached("places", f"{lat},{lon}", PLACES_TTL, lambda: fetch_nearby_places(lat, lon))
+    except Exception as e:
+        print("Overpass error:", e)
+        metrics.SERVICE_ERRORS.inc(function="get_nearby_places")
+        metrics.FALLBACKS.inc(path="get_nearby_places")
+        return []
+
+
+def fetch_nearby_places(lat, lon):
     query = f"""
     [out:json];
     node(around:5000,{lat},{lon})[tourism];
     out;
     """
-    try:
-        r = requests.post("https://overpass-api.de/api/interpreter", data={"data": query}, timeout=15)
-        data = r.json().get("elements", [])
-        places = []
-        for p in data:
-            tags = p.get("tags", {})
-            name = tags.get("name")
-            if name:
-                places.append({
-                    "name": name,
-                    "lat": p["lat"],
-                    "lon": p["lon"],
-                    "type": tags.get("tourism", "unknown")
-                })
-        return places
-    except Exception as e:
-        print("Overpass error:", e)
-        return []
+    r = upstream.post("overpass", OVERPASS_URL, data={"data": query}, timeout=15)
+    r.raise_for_status()
+    data = r.json().get("elements", [])
+    places = []
+    for p in data:
+        tags = p.get("tags", {})
+        name = tags.get("name")
+        if name:
+            places.append({
+                "name": name,
+                "lat": p["lat"],
+                "lon": p["lon"],
+                "type": tags.get("tourism", "unknown"),
+                "tags": {k: tags[k] for k in QUEST_TAGS if k in tags}
+            })
+    return places
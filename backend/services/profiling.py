@@ -0,0 +1,152 @@
+"""
+Opt-in per-request sampling profiler.
+
+Off by default. A request is profiled when it carries `X-Profile: 1` (or
+`?profile=1`) together with `X-Profile-Token: <PROFILE_TOKEN>` and passes
+the PROFILE_SAMPLE_RATE coin flip (default 0, so operators must set both).
+The same token guards GET /debug/profiles/{id}. While the endpoint runs, a
+background thread samples the stacks of the threads executing it and the
+result is stored under PROFILE_DIR as:
+  <request_id>.folded  collapsed stacks (flamegraph.pl / speedscope input)
+  <request_id>.json    summary with wall time per services/* function
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")  # operator secret; empty = profiling disabled
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "profiles")
+)
+
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def authorized(headers) -> bool:
+    """True if the request carries the operator's PROFILE_TOKEN."""
+    token = headers.get("x-profile-token", "")
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def wants_profile(headers, query_params) -> bool:
+    flag = headers.get("x-profile") or query_params.get("profile")
+    if str(flag).lower() not in ("1", "true", "yes") or not authorized(headers):
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class Sampler:
+    """
+    Samples every thread whose stack contains `target_code` (the endpoint
+    function) every `interval` seconds. Concurrent requests to the same
+    endpoint while profiling is on end up in the same profile.
+    """
+
+    def __init__(self, target_code, interval=PROFILE_INTERVAL):
+        self.target_code = target_code
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                matched = False
+                while frame is not None:
+                    matched = matched or frame.f_code is self.target_code
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if matched:
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+
+def summarize(sampler: Sampler) -> dict:
+    """Inclusive wall time per services/* function, estimated from samples."""
+    per_function = Counter()
+    for stack, count in sampler.stacks.items():
+        for name in set(stack.split(";")):
+            if name.startswith("services."):
+                per_function[name] += count
+
+    return {
+        "duration_s": round(sampler.duration, 4),
+        "samples": sampler.samples,
+        "interval_s": sampler.interval,
+        "services": {
+            name: round(count * sampler.interval, 4)
+            for name, count in per_function.most_common()
+        },
+    }
+
+
+def save(request_id, path, sampler: Sampler) -> dict:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    summary = {"request_id": request_id, "path": path, **summarize(sampler)}
+
+    with open(os.path.join(PROFILE_DIR, f"{request_id}.folded"), "w", encoding="utf-8") as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(os.path.join(PROFILE_DIR, f"{request_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    _prune()
+    return summary
+
+
+def _prune():
+    """Keep only the newest PROFILE_KEEP profiles."""
+    entries = sorted(
+        (e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".json")),
+        key=lambda e: e.stat().st_mtime
+    )
+    for entry in entries[:-PROFILE_KEEP]:
+        base = entry.path[:-len(".json")]
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(base + ext)
+            except FileNotFoundError:
+                pass
+
+
+def load(request_id, kind="json"):
+    """Return a stored profile artifact, or None if unknown."""
+    if not REQUEST_ID_RE.match(request_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{request_id}.{kind}")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f) if kind == "json" else f.read()
@@ -0,0 +1,182 @@
+"""
+Per-player push channel (SSE and WebSocket) that replaces polling of
+/player, /get_active_quest and /get_available_quests.
+
+One watcher task per process (per event loop) rebuilds the view and
+diffs it: XP/level, GeoBucks, achievements, the active quest and the
+weather of the player's quests. The diff is fanned out to a queue per
+connection, so N open connections cost one view rebuild, not N.
+Saves in this process wake the watcher immediately; saves made by other
+workers are picked up by a store re-check every POLL_S seconds. The
+watcher stops when its last connection closes.
+"""
+import asyncio
+import os
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.state import load_player, load_public_quests, on_change
+
+POLL_S = float(os.getenv("PUSH_POLL_S", "2"))
+KEEPALIVE_S = float(os.getenv("PUSH_KEEPALIVE_S", "15"))
+QUEUE_MAX = 64  # pending messages per connection; a slow one is resynced with a snapshot
+
+ACTIVE_QUEST_FIELDS = ("id", "place", "goal", "reward", "final_reward", "type", "lat", "lon")
+
+_watchers = {}  # event loop → _Watcher
+_watchers_lock = threading.Lock()
+
+
+@on_change
+def notify():
+    """Wake the watchers in this process (safe to call from any thread)."""
+    with _watchers_lock:
+        watchers = list(_watchers.values())
+    for watcher in watchers:
+        try:
+            watcher.loop.call_soon_threadsafe(watcher.wake.set)
+        except RuntimeError:  # loop already closed
+            pass
+
+
+# === VIEW & DIFF ===
+def _weather_summary(weather):
+    if not weather:
+        return None
+    air = weather.get("air_quality") or {}
+    return {
+        "weathercode": weather.get("weathercode"),
+        "temperature": weather.get("temperature"),
+        "condition_text": weather.get("condition_text"),
+        "air_quality": air.get("status"),
+    }
+
+
+def build_view():
+    """The watched slice of player + quest state, as fresh plain values."""
+    player = load_player()
+    active = player.get("active_quest")
+
+    quest_weather = {
+        q["id"]: _weather_summary(q.get("weather"))
+        for q in load_public_quests() if q.get("id")
+    }
+    if active and active.get("id"):
+        quest_weather[active["id"]] = _weather_summary(active.get("weather"))
+
+    return {
+        "level": player["level"],
+        "xp": player["xp"],
+        "geobucks": player["geobucks"],
+        "achievements": list(player["achievements"]),
+        "active_quest": {k: active.get(k) for k in ACTIVE_QUEST_FIELDS} if active else None,
+        "quest_weather": quest_weather,
+    }
+
+
+def diff(old, new):
+    """Changed top-level fields; quest_weather is diffed per quest (None = removed)."""
+    changes = {}
+    for key, value in new.items():
+        if key == "quest_weather":
+            before = old.get(key, {})
+            weather_changes = {qid: w for qid, w in value.items() if before.get(qid) != w}
+            weather_changes.update({qid: None for qid in before if qid not in value})
+            if weather_changes:
+                changes[key] = weather_changes
+        elif old.get(key) != value:
+            changes[key] = value
+    return changes
+
+
+# === WATCHER ===
+class _Watcher:
+    """Rebuilds the view once per wake-up / POLL_S and fans the diff out to the connections."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.wake = asyncio.Event()
+        self.ready = asyncio.Event()  # set once the first view is built
+        self.view = None
+        self.queues = set()
+        self.joining = 0  # connections waiting for `ready`
+        self.task = loop.create_task(self._run())
+
+    async def _run(self):
+        try:
+            self.view = await run_in_threadpool(build_view)
+        except Exception as e:
+            print("Push view error:", e)
+        self.ready.set()
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=POLL_S)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            if not self.queues and not self.joining:
+                with _watchers_lock:
+                    if _watchers.get(self.loop) is self:
+                        del _watchers[self.loop]
+                return
+
+            try:
+                view = await run_in_threadpool(build_view)
+            except Exception as e:
+                print("Push view error:", e)
+                continue
+            changes = diff(self.view, view) if self.view is not None else {}
+            self.view = view
+            if changes:
+                self._publish({"type": "update", "changes": changes})
+
+    def _publish(self, msg):
+        for queue in list(self.queues):
+            try:
+                queue.put_nowait(msg)
+            except asyncio.QueueFull:  # too far behind: start over from the current view
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "snapshot", "state": self.view})
+
+
+def _watcher():
+    loop = asyncio.get_running_loop()
+    with _watchers_lock:
+        watcher = _watchers.get(loop)
+        if watcher is None:
+            watcher = _watchers[loop] = _Watcher(loop)
+    return watcher
+
+
+# === CHANNEL ===
+async def player_updates():
+    """
+    Async generator for one connection: a snapshot first, then one
+    {"type": "update", "changes": {...}} per change, and None as a
+    keep-alive after KEEPALIVE_S without changes.
+    """
+    watcher = _watcher()
+    watcher.joining += 1
+    try:
+        await watcher.ready.wait()
+        if watcher.view is None:  # the first build failed
+            watcher.view = await run_in_threadpool(build_view)
+    finally:
+        watcher.joining -= 1
+
+    queue = asyncio.Queue(maxsize=QUEUE_MAX)
+    # Subscribe and take the snapshot without an await in between, so the
+    # first update queued is relative to exactly this snapshot.
+    watcher.queues.add(queue)
+    try:
+        yield {"type": "snapshot", "state": watcher.view}
+        while True:
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                msg = None
+            yield msg
+    finally:
+        watcher.queues.discard(queue)
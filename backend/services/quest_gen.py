@@ -1,21 +1,118 @@
-import os
+import hashlib
 import json
-import openai
-from dotenv import load_dotenv
-from services.weather import get_weather
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from services.weather import get_weather, peek_weather, weather_class
 from services.places import get_nearby_places
+from services.llm import chat, chat_stream
+from services.governor import background, governor
+from services.quest_templates import template_quest
+from services.logic import INDOOR_TYPES
+from services.store import cached, store
+from services import metrics
+from utils.calc import haversine_vec
+
+AI_GUIDE_TTL = int(os.getenv("AI_GUIDE_TTL", "21600"))  # 6 h
+QUEST_TTL = int(os.getenv("QUEST_TTL", "10800"))  # 3 h, LLM quests per place
+FALLBACK_GUIDE = "Your next adventure awaits!"
+INDOOR_ALTERNATIVES = 3  # nearest indoor places kept per outdoor quest
+# llm: always ask the LLM; fast: template quests only; auto: LLM, but template
+# quests for uncached places while the LLM governor is saturated
+QUEST_MODES = ("auto", "llm", "fast")
+QUEST_MODE = os.getenv("QUEST_MODE", "auto")
+
+TEMPLATE_QUESTS = metrics.Counter(
+    "template_quests_total",
+    "Quests built from templates instead of the LLM (requested / load / fallback / swap).",
+    ("reason",)
+)
+BACKGROUND_DROPPED = metrics.Counter(
+    "quest_background_dropped_total", "Background LLM jobs not queued (duplicate / full).",
+    ("reason",)
+)
+
+# LLM work that should not block a request (prefetches, swap messages). At
+# most BACKGROUND_MAX_PENDING jobs wait or run; a job whose key is already
+# pending is skipped and new ones past the cap are dropped, so under load
+# prefetches are shed instead of arriving long after they are useful.
+BACKGROUND_MAX_PENDING = int(os.getenv("QUEST_BACKGROUND_MAX_PENDING", "8"))
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="quest-bg")
+_background_keys = set()
+_background_lock = threading.Lock()
 
-# === Setup ===
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+def _submit_background(key, fn, *args):
+    """Run fn(*args) on the background pool unless `key` is pending or the queue is full."""
+    with _background_lock:
+        if key in _background_keys:
+            BACKGROUND_DROPPED.inc(reason="duplicate")
+            return False
+        if len(_background_keys) >= BACKGROUND_MAX_PENDING:
+            BACKGROUND_DROPPED.inc(reason="full")
+            return False
+        _background_keys.add(key)
+
+    def run():
+        try:
+            fn(*args)
+        finally:
+            with _background_lock:
+                _background_keys.discard(key)
+
+    _background.submit(run)
+    return True
 
 
 # === QUEST GENERATION ===
-def generate_quest(place):
+def fast_quest(place, reason="requested"):
+    """Template quest (services/quest_templates.py), normalized like an LLM one."""
+    TEMPLATE_QUESTS.inc(reason=reason)
+    data = template_quest(place)
+    data["generator"] = "template"
+    return _normalize_quest(data, place)
+
+
+def quest_for_place(place, mode=None):
     """
-    Generates a short AI-driven quest for a tourist visiting the given place.
-    Always ensures valid JSON and correct indoor/outdoor logic.
+    Quest for a place: the LLM quest, cached per place for QUEST_TTL so
+    pre-generated quests (services/heatmap.py) are reused, with a template
+    quest as fallback. Template quests (fast mode, load shedding, fallback)
+    are cheap and deterministic, so they are not cached.
     """
+    mode = mode or QUEST_MODE
+    if mode == "fast":
+        return fast_quest(place)
+
+    key = _quest_key(place)
+    if mode == "auto" and governor.saturated() and store.get("quests", key) is None:
+        return fast_quest(place, "load")
+    try:
+        data = cached("quests", key, QUEST_TTL, lambda: _llm_quest(place))
+    except Exception as e:
+        print("AI quest error:", e)
+        metrics.SERVICE_ERRORS.inc(function="generate_quest")
+        metrics.FALLBACKS.inc(path="generate_quest")
+        return fast_quest(place, "fallback")
+    data = dict(data, generator="llm")
+    return _normalize_quest(data, place)
+
+
+def _quest_key(place):
+    return f"{place['name']}|{round(place['lat'], 5)},{round(place['lon'], 5)}"
+
+
+def cached_quest(place):
+    """The cached LLM quest for `place` (normalized), or None; never calls the LLM."""
+    data = store.get("quests", _quest_key(place))
+    metrics.cache_lookup("quests", data is not None)
+    if data is None:
+        return None
+    return _normalize_quest(dict(data, generator="llm"), place)
+
+
+def _llm_quest(place):
+    """Raw quest JSON from the LLM; raises when the call or parsing fails."""
     prompt = f"""
     Create a short quest for a tourist visiting {place['name']} in Slovakia.
 
@@ -43,31 +140,15 @@ def generate_quest(place):
     }}
     """
 
-    try:
-        res = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        text = res.choices[0].message.content.strip()
-
-        # Ensure we only parse JSON
-        if text.startswith("```"):
-            text = text.split("```")[-2] if "```" in text else text
-        data = json.loads(text)
+    text = chat(prompt, temperature=0.7)
+
+    # Ensure we only parse JSON
+    if text.startswith("```"):
+        text = text.split("```")[-2] if "```" in text else text
+    return json.loads(text)
 
-    except Exception as e:
-        print("AI quest error:", e)
-        # fallback quest
-        data = {
-            "place": place["name"],
-            "goal": f"Explore {place['name']} and learn about its history.",
-            "reward": "20 XP",
-            "educational_info": "Local point of interest.",
-            "type": "landmark",
-            "indoor_outdoor": "outdoor"
-        }
 
+def _normalize_quest(data, place):
     # === Final post-processing ===
     data["lat"] = place.get("lat")
     data["lon"] = place.get("lon")
@@ -96,36 +177,149 @@ def generate_quest(place):
 
 
 # === AI RECOMMENDATION ===
+def _normalize(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def guide_fields(quest):
+    """The quest fields the guide message depends on: place, goal, weather class."""
+    weather = quest.get("weather") or {}
+    return {
+        "place": _normalize(quest.get("place")),
+        "goal": _normalize(quest.get("goal")),
+        "weather": weather_class(weather.get("weathercode")),
+    }
+
+
+def quest_fingerprint(quest):
+    fields = guide_fields(quest)
+    raw = json.dumps([fields["place"], fields["goal"], fields["weather"]], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _guide_prompt(quest):
+    fields = guide_fields(quest)
+    return f"""
+    You are a friendly travel AI. Based on the quest below,
+    write one short, fun sentence to inspire the user to complete it.
+
+    Place: {quest.get("place")}
+    Goal: {quest.get("goal")}
+    Weather: {fields["weather"]}
+
+    Example output:
+    "Perfect weather for exploring Spiš Castle today — let's go!"
+    """
+
+
 def ai_recommendation(quest):
     """
     Generates a friendly motivational message based on the quest.
+    Cached per quest fingerprint (place, goal, weather class) for AI_GUIDE_TTL.
     """
-    prompt = f"""
-    You are a friendly travel AI. Based on the quest JSON below,
-    write one short, fun sentence to inspire the user to complete it.
+    try:
+        return cached("ai_guide", quest_fingerprint(quest), AI_GUIDE_TTL,
+                      lambda: chat(_guide_prompt(quest), temperature=0.8))
+    except Exception as e:
+        print("AI rec error:", e)
+        metrics.SERVICE_ERRORS.inc(function="ai_recommendation")
+        metrics.FALLBACKS.inc(path="ai_recommendation")
+        return FALLBACK_GUIDE
 
-    Quest:
-    {quest}
 
-    Example output:
-    "Perfect weather for exploring Spiš Castle today — let's earn 40 XP!"
+def ai_recommendation_stream(quest):
+    """
+    Same message as ai_recommendation(), yielded in chunks: a cached message
+    comes as one chunk, a new one token by token (and is cached when done).
     """
+    key = quest_fingerprint(quest)
+    text = store.get("ai_guide", key)
+    metrics.cache_lookup("ai_guide", text is not None)
+    if text is not None:
+        yield text
+        return
+
+    parts = []
     try:
-        res = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.8
-        )
-        return res.choices[0].message.content.strip()
+        for chunk in chat_stream(_guide_prompt(quest), temperature=0.8):
+            parts.append(chunk)
+            yield chunk
     except Exception as e:
         print("AI rec error:", e)
-        return "Your next adventure awaits!"
+        metrics.SERVICE_ERRORS.inc(function="ai_recommendation")
+        metrics.FALLBACKS.inc(path="ai_recommendation")
+        if not parts:
+            yield FALLBACK_GUIDE
+        return
+
+    store.set("ai_guide", key, "".join(parts).strip(), ttl=AI_GUIDE_TTL)
+
+
+# === INDOOR ALTERNATIVES ===
+def nearest_indoor(places, lat, lon, k=INDOOR_ALTERNATIVES):
+    """The k indoor places (museum, church, restaurant, hotel) closest to (lat, lon)."""
+    indoor = [p for p in places if p.get("type") in INDOOR_TYPES]
+    if not indoor:
+        return []
+    import numpy as np
+
+    distances = haversine_vec(lat, lon, np.array([p["lat"] for p in indoor]), np.array([p["lon"] for p in indoor]))
+    order = np.argsort(distances, kind="stable")[:k]
+    return [{**indoor[i], "distance_m": round(float(distances[i]), 1)} for i in order]
+
+
+def attach_indoor_alternatives(quests, places):
+    """
+    At generation time: store the nearest indoor places on every outdoor
+    quest and pre-generate the first one's quest and weather in the
+    background, so a bad-weather swap is answered from cache.
+    """
+    for quest in quests:
+        if quest.get("indoor_outdoor") != "outdoor":
+            continue
+        quest["indoor_alternatives"] = nearest_indoor(places, quest["lat"], quest["lon"])
+        if quest["indoor_alternatives"]:
+            place = quest["indoor_alternatives"][0]
+            _submit_background(("prefetch", _quest_key(place)), _prefetch_alternative, place)
+
+
+def _prefetch_alternative(place):
+    try:
+        with background():
+            quest_for_place(place, "llm")
+            get_weather(place["lat"], place["lon"])
+    except Exception as e:
+        print("Alternative prefetch error:", e)
+        metrics.SERVICE_ERRORS.inc(function="prefetch_alternative")
+
+
+def _swap_message_key(quest, suggestion, condition):
+    raw = json.dumps([_normalize(quest.get("place")), _normalize(suggestion["name"]), _normalize(condition)],
+                     ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _fetch_swap_message(key, quest, suggestion, condition):
+    prompt = f"""
+        Weather in {quest['place']} is {condition}, not great for outdoors.
+        Write a short sentence encouraging the user to visit {suggestion['name']} instead (it's indoors).
+        """
+    try:
+        with background():
+            store.set("swap_message", key, chat(prompt, temperature=0.7), ttl=AI_GUIDE_TTL)
+    except Exception:
+        metrics.SERVICE_ERRORS.inc(function="check_quest_weather_and_recommend")
+        metrics.FALLBACKS.inc(path="check_quest_weather_and_recommend")
 
 
 # === WEATHER CHECK & RECOMMENDATION ===
 def check_quest_weather_and_recommend(quest):
     """
     Checks current weather for a quest and, if bad, recommends an indoor alternative.
+    Alternatives come from the quest's precomputed indoor_alternatives. The
+    suggested quest and the AI message are served from cache; on a miss a
+    template quest and a plain message are returned (ai_message_pending)
+    while the LLM versions are fetched in the background.
     """
     lat, lon = quest["lat"], quest["lon"]
     weather = get_weather(lat, lon)
@@ -141,10 +335,11 @@ def check_quest_weather_and_recommend(quest):
 
     # 🌧️ If outdoor quest and bad weather → suggest indoor alternative
     if quest.get("indoor_outdoor") == "outdoor" and code in bad_weather_codes:
-        nearby = get_nearby_places(lat, lon)
-        indoor_places = [p for p in nearby if p["type"] in ["museum", "church", "restaurant", "hotel"]]
+        alternatives = quest.get("indoor_alternatives")
+        if alternatives is None:  # generated before alternatives were precomputed
+            alternatives = nearest_indoor(get_nearby_places(lat, lon), lat, lon)
 
-        if not indoor_places:
+        if not alternatives:
             return {
                 "quest": quest,
                 "is_okay": False,
@@ -153,30 +348,25 @@ def check_quest_weather_and_recommend(quest):
                 "suggestion": None
             }
 
-        # Pick first indoor place
-        suggestion_place = indoor_places[0]
+        # Pick the nearest indoor place
+        suggestion_place = alternatives[0]
 
-        # Generate quest for suggestion
-        from services.quest_gen import generate_quest
-        suggested_quest = generate_quest(suggestion_place)
+        # Quest + weather for the suggestion, pre-generated at quest generation.
+        # On a miss: template quest and the weather of this (nearby) quest now,
+        # the LLM quest is left to the background prefetch.
+        suggested_quest = cached_quest(suggestion_place)
+        if suggested_quest is None:
+            suggested_quest = fast_quest(suggestion_place, "swap")
+            _submit_background(("prefetch", _quest_key(suggestion_place)), _prefetch_alternative, suggestion_place)
+        suggested_quest["weather"] = peek_weather(suggested_quest["lat"], suggested_quest["lon"]) or weather
 
-        # Attach weather
-        suggested_weather = get_weather(suggested_quest["lat"], suggested_quest["lon"])
-        suggested_quest["weather"] = suggested_weather
-
-        # AI message for suggestion
-        prompt = f"""
-        Weather in {quest['place']} is {condition}, not great for outdoors.
-        Write a short sentence encouraging the user to visit {suggestion_place['name']} instead (it's indoors).
-        """
-        try:
-            res = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
-            ai_msg = res.choices[0].message.content.strip()
-        except Exception:
+        # AI message for suggestion: cached, or fetched in the background
+        key = _swap_message_key(quest, suggestion_place, condition)
+        ai_msg = store.get("swap_message", key)
+        metrics.cache_lookup("swap_message", ai_msg is not None)
+        pending = ai_msg is None
+        if pending:
+            _submit_background(("swap_message", key), _fetch_swap_message, key, quest, suggestion_place, condition)
             ai_msg = f"Weather is {condition}. Consider visiting {suggestion_place['name']} indoors instead."
 
         return {
@@ -184,7 +374,8 @@ def check_quest_weather_and_recommend(quest):
             "is_okay": False,
             "reason": condition,
             "suggested_quest": suggested_quest,
-            "ai_message": ai_msg
+            "ai_message": ai_msg,
+            "ai_message_pending": pending
         }
 
     # 🌤️ Otherwise, quest is fine
@@ -0,0 +1,130 @@
+"""
+Public quest pool: every quest a player can pick (generated quests and
+bad-weather swap suggestions).
+
+  - id → record hash index, so lookups are O(1)
+  - records are __slots__ objects; a weather dict is kept once per distinct
+    value and referenced by key (quests of one area share it)
+  - a quest expires PUBLIC_QUEST_TTL seconds after it was added
+  - at most PUBLIC_QUEST_MAX quests; the least recently used are evicted
+
+`latest` lists the quests of the last /generate_quest call (plus swap
+suggestions added since), which is what /get_available_quests shows.
+Older quests stay selectable by id until they expire or are evicted.
+
+The pool is stored as a JSON snapshot (see services/state.py).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.payload import weather_ref
+
+PUBLIC_QUEST_TTL = int(os.getenv("PUBLIC_QUEST_TTL", "21600"))  # 6 h
+PUBLIC_QUEST_MAX = int(os.getenv("PUBLIC_QUEST_MAX", "500"))
+
+
+class PooledQuest:
+    __slots__ = ("quest", "weather_key", "expires_at")
+
+    def __init__(self, quest, weather_key, expires_at):
+        self.quest = quest  # quest dict without "weather"
+        self.weather_key = weather_key
+        self.expires_at = expires_at
+
+
+class QuestPool:
+    def __init__(self, ttl=PUBLIC_QUEST_TTL, max_size=PUBLIC_QUEST_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.records = OrderedDict()  # id → PooledQuest, least recently used first
+        self.weather = {}             # weather_key → weather dict
+        self.latest = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    # --- reads ---
+    def get(self, quest_id, now=None):
+        """The quest with this id (a fresh dict), or None if unknown or expired."""
+        now = now or time.time()
+        with self._lock:
+            record = self.records.get(quest_id)
+            if record is None:
+                return None
+            if record.expires_at <= now:
+                del self.records[quest_id]
+                return None
+            self.records.move_to_end(quest_id)
+            return self._materialize(record)
+
+    def latest_quests(self, now=None):
+        """Live quests of the last generated batch, in order."""
+        now = now or time.time()
+        with self._lock:
+            records = (self.records.get(quest_id) for quest_id in self.latest)
+            return [self._materialize(r) for r in records if r is not None and r.expires_at > now]
+
+    def _materialize(self, record):
+        quest = dict(record.quest)
+        if record.weather_key is not None:
+            quest["weather"] = self.weather[record.weather_key]
+        return quest
+
+    # --- writes ---
+    def add(self, quests, latest=False, now=None):
+        """
+        Add quests (each with an "id"). With latest=True they replace the
+        latest batch, otherwise they are appended to it.
+        """
+        now = now or time.time()
+        with self._lock:
+            if latest:
+                self.latest = []
+            for quest in quests:
+                self._put(quest, now + self.ttl)
+                self.latest.append(quest["id"])
+            self._prune(now)
+
+    def _put(self, quest, expires_at):
+        quest = dict(quest)
+        weather = quest.pop("weather", None)
+        key = None
+        if weather is not None:
+            key = weather_ref(weather)
+            self.weather.setdefault(key, weather)
+        self.records[quest["id"]] = PooledQuest(quest, key, expires_at)
+        self.records.move_to_end(quest["id"])
+
+    def _prune(self, now):
+        """Drop expired records, evict LRU beyond max_size, forget unused weather."""
+        for quest_id in [i for i, r in self.records.items() if r.expires_at <= now]:
+            del self.records[quest_id]
+        while len(self.records) > self.max_size:
+            self.records.popitem(last=False)
+        self.latest = [i for i in self.latest if i in self.records]
+        used = {r.weather_key for r in self.records.values()}
+        self.weather = {k: w for k, w in self.weather.items() if k in used}
+
+    # --- snapshot ---
+    def to_json(self):
+        with self._lock:
+            return {
+                "records": [[r.quest, r.weather_key, r.expires_at] for r in self.records.values()],
+                "weather": self.weather,
+                "latest": self.latest,
+            }
+
+    @classmethod
+    def from_json(cls, data):
+        pool = cls()
+        if isinstance(data, list):  # snapshot from before the pool: a plain quest list
+            pool.add(data, latest=True)
+        elif data:
+            for quest, weather_key, expires_at in data["records"]:
+                pool.records[quest["id"]] = PooledQuest(quest, weather_key, expires_at)
+            pool.weather = data["weather"]
+            pool.latest = data["latest"]
+        return pool
@@ -0,0 +1,119 @@
+"""
+Template quests: the fast, LLM-free way to turn a POI into a quest.
+
+The quest type comes from the OSM tags (historic / amenity / leisure),
+then a specific tourism type (hotel, museum, ...), then keywords in the
+name for generic ones like attraction (see quest_facts.json). Goal,
+reward and fact are picked from the curated corpus with a hash of the
+place, so the same place always gets the same quest while neighbours
+differ. Facts are
+taken, in order, from a known-place entry, the OSM description, other OSM
+tags (start_date, architect, heritage) and the type's general facts.
+
+Output has the same fields as an LLM quest and goes through the same
+normalization (services/quest_gen.py).
+"""
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+
+from services.logic import INDOOR_TYPES
+
+FACTS_PATH = os.path.join(os.path.dirname(__file__), "quest_facts.json")
+MAX_FACT_CHARS = 200
+
+
+@lru_cache(maxsize=1)
+def corpus():
+    """quest_facts.json, with name keywords and known-place names compiled to one regex each."""
+    with open(FACTS_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+    # whole words, allowing short Slovak case endings (hradu, kostola, parku)
+    data["name_pattern"] = _alternation(data["name_keywords"], r"\b(%s)(?:a|u|e|y|i|om|ov)?\b")
+    data["place_facts"] = {m.lower(): entry["fact"] for entry in data["places"] for m in entry["match"]}
+    data["place_pattern"] = _alternation(data["place_facts"], "(%s)")
+    return data
+
+
+def _alternation(words, template):
+    longest_first = sorted(words, key=len, reverse=True)
+    return re.compile(template % "|".join(map(re.escape, longest_first)))
+
+
+def _pick(options, digest, slot):
+    """Deterministic choice from `options` using byte `slot` of the place digest."""
+    return options[digest[slot] % len(options)]
+
+
+def quest_type(place):
+    """Quest type (one of the nine quest types) for an OSM place."""
+    data = corpus()
+    tags = place.get("tags") or {}
+
+    for key in ("historic", "amenity", "leisure"):
+        kind = data["tag_types"].get(f"{key}={tags.get(key)}")
+        if kind:
+            return kind
+
+    # A specific tourism value (hotel, museum, ...) beats the name: "Parkhotel" is a hotel.
+    tourism = place.get("type")
+    if tourism not in data["generic_tourism_types"] and tourism in data["tourism_types"]:
+        return data["tourism_types"][tourism]
+
+    match = data["name_pattern"].search(place["name"].lower())
+    if match:
+        return data["name_keywords"][match.group(1)]
+
+    return data["tourism_types"].get(tourism, "landmark")
+
+
+def _first_sentence(text):
+    text = " ".join(str(text).split())
+    end = text.find(". ")
+    text = text[:end + 1] if end != -1 else text
+    if len(text) > MAX_FACT_CHARS:
+        text = text[:MAX_FACT_CHARS].rsplit(" ", 1)[0] + "…"
+    return text if text.endswith((".", "!", "?", "…")) else text + "."
+
+
+def _facts(place, kind):
+    """Candidate facts, most specific first."""
+    data = corpus()
+    name = place["name"]
+    tags = place.get("tags") or {}
+
+    match = data["place_pattern"].search(name.lower())
+    if match:
+        return [data["place_facts"][match.group(1)]]
+
+    description = tags.get("description:en") or tags.get("description")
+    if description:
+        return [_first_sentence(description)]
+
+    from_tags = [
+        template.format(name=name, value=tags[key])
+        for key, template in data["tag_facts"].items() if tags.get(key)
+    ]
+    return from_tags or data["types"][kind]["facts"]
+
+
+def template_quest(place):
+    """Quest dict for `place` (name, lat, lon, type = OSM tourism, optional tags)."""
+    kind = quest_type(place)
+    spec = corpus()["types"][kind]
+    raw = f"{place['name']}|{round(place['lat'], 5)},{round(place['lon'], 5)}"
+    digest = hashlib.sha1(raw.encode("utf-8")).digest()
+
+    low, high = spec["reward"]
+    reward = low + 5 * (digest[0] % ((high - low) // 5 + 1))
+
+    return {
+        "place": place["name"],
+        "goal": _pick(spec["goals"], digest, 1).format(name=place["name"]),
+        "reward": f"{reward} XP",
+        "educational_info": _pick(_facts(place, kind), digest, 2),
+        "type": kind,
+        "indoor_outdoor": "indoor" if kind in INDOOR_TYPES else "outdoor",
+    }
@@ -0,0 +1,98 @@
+"""
+Game state (player, public quest pool) kept in the shared store so every
+uvicorn worker sees the same values. Listeners registered with
+`on_change` are called after every save (used by the push channel).
+"""
+import copy
+from contextlib import contextmanager
+from uuid import uuid4
+
+from services.quest_pool import QuestPool
+from services.store import store
+
+DEFAULT_PLAYER = {
+    "id": 1,
+    "name": "Traveler",
+    "level": 7,            # ⚡ Looks experienced for demo
+    "xp": 220,
+    "geobucks": 135,       # 💰 Some currency to show off purchases
+    "active_quest": None,
+    "progress": {
+        "quests_completed": 14,     # 🏆 Achievements in progress
+        "distance_walked": 12.7
+    },
+    "achievements": ["walk_10km", "finish_10_quests"]  # already unlocked a few
+}
+
+
+_listeners = []
+
+
+def on_change(fn):
+    _listeners.append(fn)
+    return fn
+
+
+def _changed():
+    for fn in _listeners:
+        fn()
+
+
+# === PLAYER ===
+def load_player():
+    player = store.get("state", "player")
+    if player is None:
+        player = copy.deepcopy(DEFAULT_PLAYER)
+        store.set("state", "player", player)
+    return player
+
+
+@contextmanager
+def player_session():
+    """Load → mutate → save the player under a cross-worker lock."""
+    with store.lock("player"):
+        player = load_player()
+        yield player
+        store.set("state", "player", player)
+    _changed()
+
+
+# === PUBLIC QUESTS ===
+# The pool is stored as a JSON snapshot plus a version stamp. Every worker
+# keeps the decoded pool and re-reads the snapshot only after another
+# worker changed it, so id lookups stay O(1).
+_pool = {"version": None, "pool": None}
+
+
+def _public_pool():
+    version = store.get("state", "public_quests_version")
+    if _pool["pool"] is None or _pool["version"] != version:
+        _pool["pool"] = QuestPool.from_json(store.get("state", "public_quests"))
+        _pool["version"] = version
+    return _pool["pool"]
+
+
+def load_public_quests():
+    """Quests of the last generated batch (plus swap suggestions added since)."""
+    return _public_pool().latest_quests()
+
+
+def get_public_quest(quest_id):
+    """Any live public quest by id, or None."""
+    return _public_pool().get(quest_id)
+
+
+def add_public_quests(quests, latest=False):
+    """Add quests to the pool; latest=True makes them the new available batch."""
+    with store.lock("public_quests"):
+        pool = _public_pool()
+        pool.add(quests, latest=latest)
+        version = uuid4().hex
+        store.set("state", "public_quests", pool.to_json())
+        store.set("state", "public_quests_version", version)
+        _pool["version"] = version
+    _changed()
+
+
+def save_public_quests(quests):
+    add_public_quests(quests, latest=True)
@@ -0,0 +1,205 @@
+"""
+Pluggable key/value store for caches and game state.
+
+STATE_BACKEND=memory  (default) plain dicts, private to one process
+STATE_BACKEND=sqlite  one SQLite file in WAL mode (STATE_DB_PATH), shared by
+                      every uvicorn worker on the box
+
+Values are namespaced (`ns`), must be JSON-serializable and may carry a TTL.
+`lock(name)` is a mutex that also holds across worker processes.
+
+Expired entries are dropped when read and, every STORE_PURGE_INTERVAL_S,
+in one sweep from the next write, so keys that are never read again do
+not pile up. The memory store also holds at most STATE_MEMORY_MAX_KEYS
+entries: beyond that the oldest entries with a TTL (caches) are evicted;
+entries without a TTL (game state) never are.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from services import metrics
+from utils.singleflight import SingleFlight
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "/tmp/geoquest-state.db")
+STATE_MEMORY_MAX_KEYS = int(os.getenv("STATE_MEMORY_MAX_KEYS", "100000"))
+STORE_PURGE_INTERVAL_S = float(os.getenv("STORE_PURGE_INTERVAL_S", "300"))
+
+PURGED = metrics.Counter(
+    "store_purged_keys_total", "Store entries removed by the periodic sweep (expired / evicted).",
+    ("reason",)
+)
+
+
+class MemoryStore:
+    def __init__(self, max_keys=STATE_MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data = {}  # insertion order = write order
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._purged_at = time.time()
+        self._limit = max_keys  # raised while game state alone exceeds max_keys
+
+    def get(self, ns, key, default=None):
+        entry = self._data.get((ns, key))
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            self._data.pop((ns, key), None)
+            return default
+        return value
+
+    def set(self, ns, key, value, ttl=None):
+        now = time.time()
+        self._data.pop((ns, key), None)  # re-insert at the end: newest write
+        self._data[(ns, key)] = (value, now + ttl if ttl else None)
+        if len(self._data) > self._limit or now - self._purged_at > STORE_PURGE_INTERVAL_S:
+            self.purge(now)
+
+    def delete(self, ns, key):
+        self._data.pop((ns, key), None)
+
+    def items(self, ns):
+        """{key: value} of the live entries in `ns`."""
+        now = time.time()
+        return {k: value for (n, k), (value, expires_at) in list(self._data.items())
+                if n == ns and (expires_at is None or expires_at >= now)}
+
+    def purge(self, now=None):
+        """Drop expired entries, then the oldest TTL entries beyond max_keys (down to 90 %)."""
+        now = now or time.time()
+        with self._guard:
+            self._purged_at = now
+            entries = list(self._data.items())
+            expired = [k for k, (_, expires_at) in entries if expires_at is not None and expires_at < now]
+            for k in expired:
+                self._data.pop(k, None)
+            PURGED.inc(len(expired), reason="expired")
+
+            excess = len(self._data) - int(self.max_keys * 0.9)
+            if excess > 0:
+                evicted = [k for k, (_, expires_at) in entries
+                           if expires_at is not None and expires_at >= now][:excess]
+                for k in evicted:
+                    self._data.pop(k, None)
+                PURGED.inc(len(evicted), reason="evicted")
+            self._limit = max(self.max_keys, int(len(self._data) * 1.1))
+
+    @contextmanager
+    def lock(self, name):
+        with self._guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            yield
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+            " PRIMARY KEY (ns, key))"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+        self._purged_at = time.time()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, ns, key, default=None):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM kv WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone()
+        if row is None:
+            return default
+        if row[1] is not None and row[1] < time.time():
+            self.delete(ns, key)
+            return default
+        return json.loads(row[0])
+
+    def set(self, ns, key, value, ttl=None):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (ns, key, json.dumps(value), now + ttl if ttl else None)
+        )
+        if now - self._purged_at > STORE_PURGE_INTERVAL_S:
+            self.purge(now)
+
+    def delete(self, ns, key):
+        self._conn().execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def items(self, ns):
+        """{key: value} of the live entries in `ns`."""
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE ns = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (ns, time.time())
+        )
+        return {key: json.loads(value) for key, value in rows}
+
+    def purge(self, now=None):
+        """Drop expired entries (every worker sweeps on its own schedule)."""
+        now = now or time.time()
+        self._purged_at = now
+        cursor = self._conn().execute("DELETE FROM kv WHERE expires_at < ?", (now,))
+        PURGED.inc(cursor.rowcount, reason="expired")
+
+    @contextmanager
+    def lock(self, name):
+        # flock on a per-name file: excludes other threads and other workers.
+        with open(f"{self.path}.{name}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _make_store():
+    if STATE_BACKEND == "sqlite":
+        return SQLiteStore(STATE_DB_PATH)
+    return MemoryStore()
+
+
+store = _make_store()
+
+# Concurrent misses on the same cache key run `fetch` only once.
+_flight = SingleFlight()
+
+
+def cached(ns, key, ttl, fetch, ok=lambda value: True):
+    """
+    Return store[ns][key], or call `fetch()` and keep its result for `ttl`
+    seconds when `ok(result)` says it is worth caching. Callers that miss
+    while the same key is already being fetched wait for that fetch.
+    """
+    value = store.get(ns, key)
+    metrics.cache_lookup(ns, value is not None)
+    if value is not None:
+        return value
+
+    def fetch_and_store():
+        result = fetch()
+        if ok(result):
+            store.set(ns, key, result, ttl=ttl)
+        return result
+
+    value, shared = _flight.do((ns, key), fetch_and_store)
+    if shared:
+        metrics.COALESCED.inc(service=f"cache:{ns}")
+    return value
@@ -0,0 +1,153 @@
+"""
+GPS track ingestion: batches of fixes → walked distance per player.
+
+Each batch is filtered and measured in one pass:
+  1. drop fixes with poor accuracy or out of order / already seen
+  2. smooth positions with a trailing mean over SMOOTH_WINDOW fixes (jitter);
+     the last raw fixes of the previous batch (`tail`) seed the window
+  3. downsample to at most one fix per SAMPLE_INTERVAL seconds
+  4. a step counts only once the position is more than JITTER_RADIUS (or
+     2× the fix's accuracy) from the last counted point (`anchor`), so a
+     phone lying still does not walk; steps faster than MAX_SPEED move the
+     anchor without being counted
+Per batch the track state is written once; walked distance is flushed to
+the player only every FLUSH_METERS / FLUSH_INTERVAL.
+"""
+import json
+import os
+import time
+
+from services.store import store
+from utils.calc import haversine
+
+MAX_ACCURACY = float(os.getenv("TRACK_MAX_ACCURACY_M", "50"))
+SMOOTH_WINDOW = int(os.getenv("TRACK_SMOOTH_WINDOW", "5"))
+SAMPLE_INTERVAL = float(os.getenv("TRACK_SAMPLE_INTERVAL_S", "10"))
+JITTER_RADIUS = float(os.getenv("TRACK_JITTER_RADIUS_M", "20"))
+MAX_SPEED = float(os.getenv("TRACK_MAX_SPEED_MS", "7"))  # faster than a jog → vehicle
+FLUSH_METERS = float(os.getenv("TRACK_FLUSH_M", "100"))
+FLUSH_INTERVAL = float(os.getenv("TRACK_FLUSH_S", "60"))
+MAX_BATCH = 5000
+
+
+class TrackError(ValueError):
+    pass
+
+
+def parse_ndjson(body: bytes):
+    """One JSON object per line: {"lat", "lon", "t" (unix s), optional "acc" (m)}."""
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise TrackError("Body is not valid UTF-8")
+    fixes = []
+    for n, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            fix = json.loads(line)
+            fixes.append((float(fix["lat"]), float(fix["lon"]), float(fix["t"]), float(fix.get("acc") or 0)))
+        except (ValueError, KeyError, TypeError):
+            raise TrackError(f"Invalid fix on line {n}")
+        if len(fixes) > MAX_BATCH:
+            raise TrackError(f"Batch larger than {MAX_BATCH} fixes")
+    return fixes
+
+
+def _smooth(values, window):
+    """Trailing moving average (shorter window at the start), via cumsum."""
+    import numpy as np
+
+    cs = np.concatenate([[0.0], np.cumsum(values)])
+    idx = np.arange(1, len(values) + 1)
+    lo = np.maximum(idx - window, 0)
+    return (cs[idx] - cs[lo]) / (idx - lo)
+
+
+def measure_batch(fixes, anchor=None, tail=()):
+    """
+    Filter + distance for one batch. `anchor` is the last counted point and
+    `tail` the last raw fixes of the previous batch (smoothing state).
+    Returns (metres walked, anchor, tail, accepted count).
+    """
+    import numpy as np
+
+    tail = [tuple(f) for f in tail]
+    if not fixes:
+        return 0.0, anchor, tail, 0
+
+    arr = np.asarray(fixes, dtype=float)
+    arr = arr[np.argsort(arr[:, 2], kind="stable")]
+
+    valid = (
+        (np.abs(arr[:, 0]) <= 90) & (np.abs(arr[:, 1]) <= 180)
+        & (arr[:, 3] <= MAX_ACCURACY)
+    )
+    last_t = tail[-1][2] if tail else (anchor[2] if anchor else None)
+    if last_t is not None:
+        valid &= arr[:, 2] > last_t
+    arr = arr[valid]
+    if len(arr) == 0:
+        return 0.0, anchor, tail, 0
+    accepted = len(arr)
+
+    raw = np.vstack([np.asarray(tail, dtype=float).reshape(-1, 4), arr])
+    tail = [tuple(float(v) for v in f) for f in raw[len(raw) - (SMOOTH_WINDOW - 1):]] if SMOOTH_WINDOW > 1 else []
+    smoothed = raw.copy()
+    smoothed[:, 0] = _smooth(raw[:, 0], SMOOTH_WINDOW)
+    smoothed[:, 1] = _smooth(raw[:, 1], SMOOTH_WINDOW)
+    arr = smoothed[len(raw) - accepted:]
+
+    # Downsample: keep the first fix of every SAMPLE_INTERVAL bucket
+    buckets = np.floor(arr[:, 2] / SAMPLE_INTERVAL)
+    _, first = np.unique(buckets, return_index=True)
+    arr = arr[first]
+
+    metres = 0.0
+    for lat, lon, t, acc in arr.tolist():
+        if anchor is None:
+            anchor = (lat, lon, t, acc)
+            continue
+        step = haversine(anchor[0], anchor[1], lat, lon)
+        if step <= max(JITTER_RADIUS, 2 * acc):
+            continue  # still within GPS noise of the last counted point
+        if step / max(t - anchor[2], 1e-3) <= MAX_SPEED:  # not a car/bus/GPS jump
+            metres += step
+        anchor = (lat, lon, t, acc)
+    return metres, anchor, tail, accepted
+
+
+def ingest(player_id, fixes, flush):
+    """
+    Apply one batch for `player_id`. `flush(km)` is called with the pending
+    distance when it is due and must add it to the player's progress.
+    """
+    key = str(player_id)
+    with store.lock(f"track:{key}"):
+        track = store.get("tracks", key) or {"anchor": None, "pending_m": 0.0, "flushed_at": time.time()}
+        anchor = tuple(track["anchor"]) if track["anchor"] else None
+
+        metres, anchor, tail, accepted = measure_batch(fixes, anchor, track.get("tail", ()))
+        track["anchor"] = list(anchor) if anchor else None
+        track["tail"] = [list(f) for f in tail]
+        track["pending_m"] += metres
+
+        flushed_km = 0.0
+        now = time.time()
+        due = track["pending_m"] >= FLUSH_METERS or now - track["flushed_at"] >= FLUSH_INTERVAL
+        if due and track["pending_m"] > 0:
+            flushed_km = track["pending_m"] / 1000
+            flush(flushed_km)
+            track["pending_m"] = 0.0
+            track["flushed_at"] = now
+
+        store.set("tracks", key, track)
+
+    return {
+        "received": len(fixes),
+        "accepted": accepted,
+        "distance_m": round(metres, 1),
+        "pending_m": round(track["pending_m"], 1),
+        "flushed_km": round(flushed_km, 4),
+    }
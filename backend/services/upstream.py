@@ -0,0 +1,125 @@
+"""
+Single entry point for outgoing HTTP calls made by services/*.
+Wraps `requests` and adds record / replay of upstream responses and
+single-flight coalescing of identical concurrent requests.
+"""
+import os
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import fixtures, metrics
+from utils.singleflight import SingleFlight
+
+# Pool sized for the threadpool that runs sync endpoints, so concurrent
+# calls to the same upstream reuse keep-alive connections.
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "40"))
+
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE))
+session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE))
+
+# Request fields that must not decide the fixture key (they carry credentials).
+UNKEYED_FIELDS = {"cdse_auth": {"data"}}
+
+# Every upstream call made by services/* is a read, so identical concurrent
+# requests can share one response.
+flight = SingleFlight()
+
+
+def _flight_key(service, method, url, kwargs):
+    # Normalized request: host + path + sorted query params + body.
+    parts = urlsplit(url)
+    params = kwargs.get("params") or {}
+    query = sorted(parse_qsl(parts.query) + sorted(dict(params).items()))
+    return fixtures.fixture_key(
+        service, method.upper(), parts.netloc, parts.path, query,
+        kwargs.get("data"), kwargs.get("json")
+    )
+
+
+def _key(service, method, url, kwargs):
+    # Host and headers are left out on purpose: fixtures recorded against one
+    # deployment replay against another, and headers carry bearer tokens.
+    parts = urlsplit(url)
+    skip = UNKEYED_FIELDS.get(service, set())
+    fields = [None if f in skip else kwargs.get(f) for f in ("params", "data", "json")]
+    return fixtures.fixture_key(method.upper(), parts.path, parts.query, *fields)
+
+
+def _replay(service, method, url, kwargs):
+    meta, body = fixtures.load(service, _key(service, method, url, kwargs))
+    r = requests.Response()
+    r.status_code = meta["status"]
+    r.headers.update(meta.get("headers", {}))
+    r.encoding = meta.get("encoding")
+    r.url = meta.get("url", url)
+    r._content = body
+    return r
+
+
+def request(service: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request on behalf of `service` (overpass, open_meteo, cdse_auth, ...).
+    Behaves like `requests.request`; in replay mode the network is never used.
+    Concurrent identical requests are sent once and share the response.
+    """
+    r, shared = flight.do(
+        _flight_key(service, method, url, kwargs),
+        lambda: _send(service, method, url, kwargs)
+    )
+    if shared:
+        metrics.COALESCED.inc(service=service)
+    return r
+
+
+def _send(service, method, url, kwargs):
+    if fixtures.replaying():
+        return _replay(service, method, url, kwargs)
+
+    start = time.perf_counter()
+    try:
+        r = session.request(method, url, **kwargs)
+    except Exception:
+        metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - start, service=service, status="error")
+        metrics.UPSTREAM_ERRORS.inc(service=service)
+        raise
+    elapsed = time.perf_counter() - start
+
+    metrics.UPSTREAM_LATENCY.observe(elapsed, service=service, status=r.status_code)
+    if r.status_code >= 400:
+        metrics.UPSTREAM_ERRORS.inc(service=service)
+
+    if fixtures.recording():
+        fixtures.save(service, _key(service, method, url, kwargs), {
+            "service": service,
+            "method": method.upper(),
+            "url": r.url,
+            "status": r.status_code,
+            "headers": {"Content-Type": r.headers.get("Content-Type", "")},
+            "encoding": r.encoding,
+            "elapsed": round(elapsed, 4),
+            "size": len(r.content),
+        }, r.content)
+    return r
+
+
+def get(service, url, **kwargs):
+    return request(service, "GET", url, **kwargs)
+
+
+def post(service, url, **kwargs):
+    return request(service, "POST", url, **kwargs)
+
+
+def warm_up(urls):
+    """Open a keep-alive connection to each upstream so the first real call skips DNS + TLS."""
+    if fixtures.replaying():
+        return
+    for url in urls:
+        try:
+            session.head(url, timeout=3)
+        except Exception as e:
+            print("Warm-up connection error:", url, e)
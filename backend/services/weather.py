@@ -1,8 +1,22 @@
 import os
-import requests
-import numpy as np
-import tifffile
+import time
+from datetime import datetime, timezone
 from io import BytesIO
+from services import metrics, upstream
+from services.copernicus_auth import get_copernicus_token
+from services.store import cached, store
+
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+CDSE_PROCESS_URL = os.getenv("CDSE_PROCESS_URL", "https://sh.dataspace.copernicus.eu/api/v1/process")
+
+# Cache lifetimes (seconds). Keys are coordinates rounded to ~100 m.
+WEATHER_TTL = int(os.getenv("WEATHER_TTL", "600"))
+AIR_QUALITY_TTL = int(os.getenv("AIR_QUALITY_TTL", "3600"))
+WEATHER_HISTORY_TTL = int(os.getenv("WEATHER_HISTORY_TTL", str(7 * 86400)))  # days that are fully over
+
+
+def coord_key(lat, lon):
+    return f"{round(float(lat), 3)},{round(float(lon), 3)}"
 
 
 # === WEATHER MAPPING ===
@@ -37,14 +51,40 @@ def decode_weather(code: int):
     return mapping.get(code, "unknown")
 
 
+def weather_class(code):
+    """Coarse class of a weathercode (clear, cloudy, fog, rain, snow, storm, unknown)."""
+    if code is None:
+        return "unknown"
+    if code in (0, 1):
+        return "clear"
+    if code in (2, 3):
+        return "cloudy"
+    if code in (45, 48):
+        return "fog"
+    if code in (71, 73, 75, 77, 85, 86):
+        return "snow"
+    if code in (95, 96, 99):
+        return "storm"
+    if 51 <= code <= 82:
+        return "rain"
+    return "unknown"
+
+
 # === BASIC WEATHER (Open-Meteo) ===
+def fetch_current_weather(lat, lon):
+    url = f"{OPEN_METEO_URL}?latitude={lat}&longitude={lon}&current_weather=true"
+    r = upstream.get("open_meteo", url, timeout=10)
+    r.raise_for_status()
+    data = r.json().get("current_weather", {})
+    code = data.get("weathercode", 0)
+    data["condition_text"] = decode_weather(code)
+    return data
+
+
 def get_weather(lat, lon):
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
     try:
-        r = requests.get(url, timeout=10)
-        data = r.json().get("current_weather", {})
-        code = data.get("weathercode", 0)
-        data["condition_text"] = decode_weather(code)
+        data = dict(cached("weather", coord_key(lat, lon), WEATHER_TTL,
+                           lambda: fetch_current_weather(lat, lon)))
 
         # Add air quality
         aq = get_air_quality(lat, lon)
@@ -53,31 +93,88 @@ def get_weather(lat, lon):
         return data
     except Exception as e:
         print("Weather error:", e)
+        metrics.SERVICE_ERRORS.inc(function="get_weather")
+        metrics.FALLBACKS.inc(path="get_weather")
         return {"weathercode": 0, "temperature": 0, "condition_text": "unknown", "air_quality": None}
 
 
+def peek_weather(lat, lon):
+    """Cached weather (+ air quality) for (lat, lon) without fetching; None on miss."""
+    key = coord_key(lat, lon)
+    data = store.get("weather", key)
+    if data is None:
+        return None
+    return {**data, "air_quality": store.get("air_quality", key)}
+
+
+# === HISTORICAL WEATHER (offline completions) ===
+def fetch_hourly_weather(lat, lon, day):
+    """Hourly weathercode + temperature (UTC) for one day; lists of 24 values."""
+    url = (f"{OPEN_METEO_URL}?latitude={lat}&longitude={lon}"
+           f"&hourly=weathercode,temperature_2m&start_date={day}&end_date={day}&timezone=UTC")
+    r = upstream.get("open_meteo", url, timeout=10)
+    r.raise_for_status()
+    hourly = r.json().get("hourly", {})
+    return {"weathercode": hourly.get("weathercode", []), "temperature": hourly.get("temperature_2m", [])}
+
+
+def weather_at(lat, lon, ts):
+    """
+    Weather at (lat, lon) at unix time `ts`. Recent times use get_weather();
+    older ones the hourly history, cached per ~100 m cell and UTC day, so a
+    batch of completions in one place costs one upstream call. Past days
+    are kept for WEATHER_HISTORY_TTL; today's later hours are still
+    forecasts, so today is kept only for WEATHER_TTL. Air quality is only
+    taken from the cache (there is no history for it).
+    """
+    if time.time() - ts < WEATHER_TTL:
+        return get_weather(lat, lon)
+
+    when = datetime.fromtimestamp(ts, timezone.utc)
+    day = when.strftime("%Y-%m-%d")
+    key = coord_key(lat, lon)
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    ttl = WEATHER_HISTORY_TTL if day < today else WEATHER_TTL
+    try:
+        hours = cached("weather_history", f"{key}|{day}", ttl,
+                       lambda: fetch_hourly_weather(lat, lon, day),
+                       ok=lambda h: len(h["weathercode"]) == 24)
+        code = hours["weathercode"][when.hour]
+        if code is None:
+            raise ValueError(f"no weathercode for {day} {when.hour}:00")
+    except Exception as e:
+        print("Weather history error:", e)
+        metrics.SERVICE_ERRORS.inc(function="weather_at")
+        metrics.FALLBACKS.inc(path="weather_at")
+        return get_weather(lat, lon)
+
+    return {
+        "weathercode": code,
+        "temperature": hours["temperature"][when.hour],
+        "condition_text": decode_weather(code),
+        "time": when.strftime("%Y-%m-%dT%H:00"),
+        "air_quality": store.get("air_quality", key),
+    }
+
+
 # === AIR QUALITY (Sentinel-5P Copernicus) ===
 def get_air_quality(lat, lon):
+    """Cached air quality for the ~100 m cell around (lat, lon); errors are not cached."""
+    return cached("air_quality", coord_key(lat, lon), AIR_QUALITY_TTL,
+                  lambda: fetch_air_quality(lat, lon),
+                  ok=lambda aq: aq.get("status") != "error")
+
+
+def fetch_air_quality(lat, lon):
     """
     Fetches NO2 concentration from Copernicus Sentinel-5P via the /process API.
     Returns simplified air quality data for GeoQuest.
     """
     try:
-        # === 1. Authenticate (you can reuse token or store it in env)
-        token_url = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
-        data = {
-            "client_id": "cdse-public",
-            "grant_type": "password",
-            "username": os.getenv("COPERNICUS_USER"),  # store in .env
-            "password": os.getenv("COPERNICUS_PASS")
-        }
-        response_T = requests.post(token_url, data=data, timeout=15)
-        token = response_T.json().get("access_token")
-        if not token:
-            raise Exception("Failed to get Copernicus access token")
+        # === 1. Authenticate (token cached and shared across workers)
+        token = get_copernicus_token()
 
         # === 2. Request Sentinel-5P NO2 data
-        url = "https://sh.dataspace.copernicus.eu/api/v1/process"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {token}"
@@ -122,12 +219,17 @@ def get_air_quality(lat, lon):
             """
         }
 
-        resp = requests.post(url, headers=headers, json=payload, timeout=45)
+        resp = upstream.post("cdse_process", CDSE_PROCESS_URL, headers=headers, json=payload, timeout=45)
         if resp.status_code != 200:
             print("Air quality fetch error:", resp.text)
+            metrics.SERVICE_ERRORS.inc(function="get_air_quality")
+            metrics.FALLBACKS.inc(path="get_air_quality")
             return {"status": "error", "description": "Failed to fetch air quality"}
 
-        # === 3. Decode TIFF result
+        # === 3. Decode TIFF result (heavy imports kept off the startup path)
+        import numpy as np
+        import tifffile
+
         tiff_data = BytesIO(resp.content)
         img_array = tifffile.imread(tiff_data)
 
@@ -152,4 +254,6 @@ def get_air_quality(lat, lon):
 
     except Exception as e:
         print("Air quality error:", e)
+        metrics.SERVICE_ERRORS.inc(function="get_air_quality")
+        metrics.FALLBACKS.inc(path="get_air_quality")
         return {"status": "error", "description": "unavailable"}
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+Compiled zone catalog: quest_zones.json built into an indexed SQLite file.
+
+    python -m services.zone_artifact build [zones.json] [zones.db]
+    python -m services.zone_artifact find <qr_key> [zones.db]
+
+Tables:
+  meta    format, version (hash over all zone hashes)
+  zones   code (primary key), ord (file order), hash (sha1 of the zone's
+          canonical JSON), body (zone JSON), coords (float64 lat/lon pairs:
+          zone centre, then every quest)
+  quests  qr_key and id → zone code + position, both indexed
+  places  lower-cased zone and quest place names → zone code, indexed
+
+A build diffs the zone hashes against an existing artifact and writes
+only new, changed and removed zones in one transaction, so the server
+(services/zones.py) can hot-swap just those zones. Readers open the file
+read-only with SQLite memory-mapped I/O and look zones up through the
+indexes; an artifact of an older FORMAT is rebuilt from scratch.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+FORMAT = 2
+MMAP_SIZE = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS zones (
+    code TEXT PRIMARY KEY, ord INTEGER NOT NULL, hash TEXT NOT NULL,
+    body TEXT NOT NULL, coords BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS quests (
+    id TEXT NOT NULL, qr_key TEXT, code TEXT NOT NULL, idx INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS quests_qr_key ON quests (qr_key);
+CREATE INDEX IF NOT EXISTS quests_id ON quests (id);
+CREATE INDEX IF NOT EXISTS quests_code ON quests (code);
+CREATE TABLE IF NOT EXISTS places (name TEXT NOT NULL, code TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS places_name ON places (name);
+CREATE INDEX IF NOT EXISTS places_code ON places (code);
+"""
+
+
+def zone_hash(zone):
+    raw = json.dumps(zone, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def catalog_version(hashes):
+    """Version of a catalog from its zone hashes in file order."""
+    return hashlib.sha1("|".join(hashes).encode()).hexdigest()[:16]
+
+
+def zone_coords(zone):
+    """Zone centre + quest coordinates as a flat float64 array [lat, lon, lat, lon, ...]."""
+    import numpy as np
+
+    points = [(zone["lat"], zone["lon"])] + [(q["lat"], q["lon"]) for q in zone["quests"]]
+    return np.asarray(points, dtype=np.float64).ravel()
+
+
+# === BUILD ===
+def build(src, dst):
+    """
+    Compile `src` (zones JSON) into `dst`. Returns (added, changed, removed)
+    zone codes; an unchanged catalog writes nothing.
+    """
+    with open(src, "rb") as f:
+        zones = json.loads(f.read())
+    hashes = [zone_hash(zone) for zone in zones]
+    version = catalog_version(hashes)
+
+    conn = sqlite3.connect(dst, isolation_level=None)
+    try:
+        if _format(conn) not in (None, str(FORMAT)):
+            conn.executescript("DROP TABLE IF EXISTS meta; DROP TABLE IF EXISTS zones; "
+                               "DROP TABLE IF EXISTS quests; DROP TABLE IF EXISTS places;")
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row and row[0] == version:
+            conn.execute("ROLLBACK")
+            return [], [], []
+
+        old = {code: (ord_, h) for code, ord_, h in conn.execute("SELECT code, ord, hash FROM zones")}
+        new_codes = {zone["code"] for zone in zones}
+        added, changed = [], []
+        for i, (zone, h) in enumerate(zip(zones, hashes)):
+            code = zone["code"]
+            if code not in old or old[code][1] != h:
+                (added if code not in old else changed).append(code)
+                _write_zone(conn, zone, i, h)
+            elif old[code][0] != i:
+                conn.execute("UPDATE zones SET ord = ? WHERE code = ?", (i, code))
+        removed = [code for code in old if code not in new_codes]
+        for code in removed:
+            conn.execute("DELETE FROM zones WHERE code = ?", (code,))
+            conn.execute("DELETE FROM quests WHERE code = ?", (code,))
+            conn.execute("DELETE FROM places WHERE code = ?", (code,))
+        conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         [("format", str(FORMAT)), ("version", version)])
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return added, changed, removed
+
+
+def _format(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+    except sqlite3.OperationalError:  # new file
+        return None
+    return row[0] if row else None
+
+
+def _write_zone(conn, zone, ord_, h):
+    code = zone["code"]
+    conn.execute(
+        "INSERT OR REPLACE INTO zones (code, ord, hash, body, coords) VALUES (?, ?, ?, ?, ?)",
+        (code, ord_, h, json.dumps(zone, ensure_ascii=False), zone_coords(zone).tobytes()),
+    )
+    conn.execute("DELETE FROM quests WHERE code = ?", (code,))
+    conn.executemany(
+        "INSERT INTO quests (id, qr_key, code, idx) VALUES (?, ?, ?, ?)",
+        [(q["id"], q.get("qr_key"), code, i) for i, q in enumerate(zone["quests"])],
+    )
+    conn.execute("DELETE FROM places WHERE code = ?", (code,))
+    names = {zone["name"].lower()} | {q["place"].lower() for q in zone["quests"]}
+    conn.executemany("INSERT INTO places (name, code) VALUES (?, ?)", [(name, code) for name in names])
+
+
+# === READ ===
+class ZoneArtifact:
+    """
+    Read-only, memory-mapped connection to a compiled catalog. Shared by
+    request threads, so every query runs under one lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = os.stat(path).st_ino
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def version(self):
+        rows = self._query("SELECT value FROM meta WHERE key = 'version'")
+        return rows[0][0] if rows else None
+
+    def hashes(self):
+        """[(code, hash)] in file order."""
+        return self._query("SELECT code, hash FROM zones ORDER BY ord")
+
+    def coords(self, codes):
+        """{code: coordinate array} for the given codes (zone bodies are not read)."""
+        import numpy as np
+
+        codes = list(codes)
+        found = {}
+        for start in range(0, len(codes), 500):  # SQLite host parameter limit
+            chunk = codes[start:start + 500]
+            rows = self._query(f"SELECT code, coords FROM zones WHERE code IN ({','.join('?' * len(chunk))})", chunk)
+            for code, coords in rows:
+                found[code] = np.frombuffer(coords, dtype=np.float64)
+        return found
+
+    def zone(self, code):
+        """Decoded zone, or None."""
+        import orjson
+
+        rows = self._query("SELECT body FROM zones WHERE code = ?", (code,))
+        return orjson.loads(rows[0][0]) if rows else None
+
+    def find_quest(self, qr_key):
+        """(zone code, quest index) for a qr_key via the artifact index, or None."""
+        rows = self._query("SELECT code, idx FROM quests WHERE qr_key = ?", (qr_key,))
+        return rows[0] if rows else None
+
+    def find_quest_id(self, quest_id):
+        """(zone code, quest index) for a quest id, or None."""
+        rows = self._query("SELECT code, idx FROM quests WHERE id = ?", (quest_id,))
+        return rows[0] if rows else None
+
+    def has_place(self, name):
+        """True if a zone or zone quest has this (lower-cased) place name."""
+        return bool(self._query("SELECT 1 FROM places WHERE name = ? LIMIT 1", (name,)))
+
+    def qr_keys(self):
+        return [row[0] for row in self._query("SELECT qr_key FROM quests WHERE qr_key IS NOT NULL")]
+
+    def quest_ids(self):
+        """{code: [quest id, ...]} in quest order."""
+        ids = {}
+        for code, quest_id in self._query("SELECT code, id FROM quests ORDER BY code, idx"):
+            ids.setdefault(code, []).append(quest_id)
+        return ids
+
+
+def main(argv):
+    from services.zones import ZONES_DB_PATH, ZONES_PATH
+
+    if argv[:1] == ["build"]:
+        src = argv[1] if len(argv) > 1 else ZONES_PATH
+        dst = argv[2] if len(argv) > 2 else ZONES_DB_PATH
+        added, changed, removed = build(src, dst)
+        print(f"{dst}: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+    elif argv[:1] == ["find"] and len(argv) > 1:
+        artifact = ZoneArtifact(argv[2] if len(argv) > 2 else ZONES_DB_PATH)
+        print(artifact.find_quest(argv[1]))
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
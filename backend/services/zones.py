@@ -1,14 +1,277 @@
-import json, os
+import hashlib, json, os, sqlite3, threading
+from collections import OrderedDict
+
+from services import metrics
+from services.zone_artifact import ZoneArtifact, zone_coords
 
 ZONES_PATH = os.path.join(os.path.dirname(__file__), "quest_zones.json")
+# Compiled catalog (services/zone_artifact.py); used instead of the JSON when present.
+ZONES_DB_PATH = os.getenv("ZONES_DB_PATH", os.path.join(os.path.dirname(__file__), "quest_zones.db"))
+
+ZONE_CACHE_SIZE = int(os.getenv("ZONE_CACHE_SIZE", "1024"))  # decoded zones per worker
+
+ZONES_SWAPPED = metrics.Counter(
+    "zone_catalog_swapped_zones_total", "Zones (re)indexed on catalog reloads (added / changed / removed).",
+    ("change",)
+)
+
+# Parsed zones, re-read only when the file's mtime changes.
+_ZONES_CACHE = {"mtime": None, "zones": None, "version": None}
+_zones_lock = threading.Lock()
+
+
+def _read_zones_json():
+    mtime = os.path.getmtime(ZONES_PATH)
+    if _ZONES_CACHE["mtime"] != mtime:
+        with _zones_lock:
+            if _ZONES_CACHE["mtime"] != mtime:
+                with open(ZONES_PATH, "rb") as f:
+                    raw = f.read()
+                _ZONES_CACHE["zones"] = json.loads(raw)
+                _ZONES_CACHE["version"] = hashlib.sha1(raw).hexdigest()[:16]
+                _ZONES_CACHE["mtime"] = mtime
+    return _ZONES_CACHE["zones"]
+
+
+# === CATALOG INDEX ===
+def _summary(zone):
+    """Public map summary of a zone (no qr_keys)."""
+    return {
+        "code": zone["code"],
+        "name": zone["name"],
+        "description": zone.get("description"),
+        "type": zone.get("type"),
+        "lat": zone["lat"],
+        "lon": zone["lon"],
+        "quest_count": len(zone["quests"]),
+        "quests": [
+            {k: q.get(k) for k in ("id", "place", "type", "lat", "lon")}
+            for q in zone["quests"]
+        ],
+    }
+
+
+class ZoneCatalog:
+    """
+    Lookup structures over one version of the zone file: zones by code,
+    quests by qr_key and id, public map summaries (no qr_keys) and a spatial
+    index over zone centres and quest coordinates. The whole file is held
+    in memory; see ArtifactCatalog for the compiled catalog.
+
+    The spatial index is a set of NumPy arrays sorted by latitude: a bbox
+    query is a binary search for the latitude band plus one vectorized
+    longitude mask, so it stays in the millisecond range for tens of
+    thousands of zones, whatever the size of the box.
+    """
+
+    def __init__(self, zones, version):
+        self.zones = zones
+        self.version = version
+        self.codes = [zone["code"] for zone in zones]
+        self.by_code = {}
+        self.by_qr_key = {}
+        self.by_quest_id = {}
+        self.summaries = {}
+        self.place_names = set()
+        for zone in zones:
+            self.by_code[zone["code"]] = zone
+            self.place_names.add(zone["name"].lower())
+            for quest in zone["quests"]:
+                self.place_names.add(quest["place"].lower())
+                if quest.get("qr_key"):
+                    self.by_qr_key[quest["qr_key"]] = (zone, quest)
+                self.by_quest_id[quest["id"]] = (zone, quest)
+            self.summaries[zone["code"]] = _summary(zone)
+        self._build_spatial([zone_coords(zone) for zone in zones])
+
+    def _build_spatial(self, coords):
+        """Lat-sorted arrays from per-zone [lat, lon, ...] arrays (in self.codes order)."""
+        import numpy as np
+
+        points = [c.reshape(-1, 2) for c in coords]
+        stacked = np.concatenate(points) if points else np.empty((0, 2))
+        owners = np.repeat(np.arange(len(points), dtype=np.int64), [len(p) for p in points])
+
+        order = np.argsort(stacked[:, 0], kind="stable")
+        self.lats = stacked[order, 0]
+        self.lons = stacked[order, 1]
+        self.owners = owners[order]
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Codes of zones whose centre or any quest lies in the box, in file order."""
+        import numpy as np
+
+        lo = np.searchsorted(self.lats, min_lat, side="left")
+        hi = np.searchsorted(self.lats, max_lat, side="right")
+        lons = self.lons[lo:hi]
+        owners = self.owners[lo:hi][(lons >= min_lon) & (lons <= max_lon)]
+        return [self.codes[i] for i in np.unique(owners)]
+
+    def qr_keys(self):
+        return [q["qr_key"] for zone in self.zones for q in zone["quests"] if q.get("qr_key")]
+
+    def fence_points(self):
+        """(code, lat, lon, [(quest id, lat, lon), ...]) per zone, for the geofence grid."""
+        for zone in self.zones:
+            yield zone["code"], zone["lat"], zone["lon"], [(q["id"], q["lat"], q["lon"]) for q in zone["quests"]]
+
+
+class _Lookup:
+    """Read-only mapping answered by `fetch(key)`, which returns None for a missing key."""
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+
+    def get(self, key, default=None):
+        value = self._fetch(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self._fetch(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._fetch(key) is not None
+
+
+class ArtifactCatalog(ZoneCatalog):
+    """
+    ZoneCatalog over the compiled artifact. Only zone codes, hashes and
+    coordinate arrays (for in_bbox) are held in memory, read from the
+    coords blobs without decoding a zone body. by_code, by_qr_key,
+    by_quest_id, summaries and place_names are answered from the artifact
+    indexes; the last ZONE_CACHE_SIZE decoded zones are kept (LRU).
+
+    `previous` is the catalog being replaced: coordinate arrays and cached
+    zones whose hash did not change are carried over, so a reload reads
+    only the changed zones' coords.
+    """
+
+    def __init__(self, artifact, previous=None):
+        self.artifact = artifact
+        self.version = artifact.version()
+        self.hashes = dict(artifact.hashes())
+        self.codes = list(self.hashes)
+
+        old = previous.hashes if previous is not None else {}
+        kept = {code for code, h in self.hashes.items() if old.get(code) == h}
+        self.coords = {code: previous.coords[code] for code in kept}
+        self.coords.update(artifact.coords(code for code in self.codes if code not in kept))
+        self._build_spatial([self.coords[code] for code in self.codes])
+        if previous is not None:
+            for code in self.codes:
+                if code not in kept:
+                    ZONES_SWAPPED.inc(change="changed" if code in old else "added")
+            for code in old:
+                if code not in self.hashes:
+                    ZONES_SWAPPED.inc(change="removed")
+
+        self._cache = OrderedDict()  # code → (zone, summary), least recently used first
+        if previous is not None:
+            self._cache.update((code, v) for code, v in previous._cache.items() if code in kept)
+        self._cache_lock = threading.Lock()
+
+        self.by_code = _Lookup(lambda code: self._cached(code)[0])
+        self.summaries = _Lookup(lambda code: self._cached(code)[1])
+        self.by_qr_key = _Lookup(lambda qr_key: self._quest(artifact.find_quest(qr_key)))
+        self.by_quest_id = _Lookup(lambda quest_id: self._quest(artifact.find_quest_id(quest_id)))
+        self.place_names = _Lookup(lambda name: artifact.has_place(name) or None)
+
+    def _cached(self, code):
+        """(zone, summary), or (None, None) for an unknown code."""
+        with self._cache_lock:
+            if code in self._cache:
+                self._cache.move_to_end(code)
+                return self._cache[code]
+        if code not in self.hashes:
+            return None, None
+        zone = self.artifact.zone(code)
+        if zone is None:
+            return None, None
+        entry = (zone, _summary(zone))
+        with self._cache_lock:
+            self._cache[code] = entry
+            while len(self._cache) > ZONE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return entry
+
+    def _quest(self, found):
+        if not found:
+            return None
+        zone = self.by_code.get(found[0])
+        return (zone, zone["quests"][found[1]]) if zone else None
+
+    def qr_keys(self):
+        return self.artifact.qr_keys()
+
+    def fence_points(self):
+        quest_ids = self.artifact.quest_ids()
+        for code in self.codes:
+            points = self.coords[code].reshape(-1, 2).tolist()
+            ids = quest_ids.get(code, [])
+            yield code, points[0][0], points[0][1], [(i, lat, lon) for i, (lat, lon) in zip(ids, points[1:])]
+
+
+_catalog = {"zones": None, "index": None, "artifact": None, "stamp": None}
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    ArtifactCatalog of the compiled artifact if there is one (ZONES_DB_PATH),
+    else ZoneCatalog of the JSON file; reloaded when either changes.
+    """
+    try:
+        stat = os.stat(ZONES_DB_PATH)
+    except FileNotFoundError:
+        return _json_catalog()
+
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _catalog["stamp"] != stamp:
+        with _catalog_lock:
+            if _catalog["stamp"] != stamp:
+                try:
+                    _reload_artifact(stat.st_ino)
+                except sqlite3.Error as e:  # keep serving the loaded catalog
+                    print("Zone artifact error:", e)
+                    metrics.SERVICE_ERRORS.inc(function="zone_artifact")
+                _catalog["stamp"] = stamp
+    return _catalog["index"] or _json_catalog()
+
+
+def _json_catalog():
+    zones = _read_zones_json()
+    if _catalog["zones"] is not zones:
+        with _catalog_lock:
+            if _catalog["zones"] is not zones:
+                _catalog["index"] = ZoneCatalog(zones, _ZONES_CACHE["version"])
+                _catalog["zones"] = zones
+    return _catalog["index"]
+
+
+def _reload_artifact(inode):
+    """Swap in a catalog for the current artifact, reusing unchanged zones."""
+    artifact = _catalog["artifact"]
+    # A replaced file gets a new connection; the old one is closed when the
+    # catalogs still serving requests with it are released.
+    if artifact is None or artifact.inode != inode:
+        artifact = _catalog["artifact"] = ZoneArtifact(ZONES_DB_PATH)
+
+    current = _catalog["index"]
+    if not isinstance(current, ArtifactCatalog):
+        current = None
+    elif current.version == artifact.version() and current.artifact is artifact:
+        return
+    _catalog["index"] = ArtifactCatalog(artifact, current)
+    _catalog["zones"] = None
 
-def load_zones():
-    with open(ZONES_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
 
 def find_zone_by_code(code: str):
-    zones = load_zones()
-    for z in zones:
-        if z["code"] == code:
-            return z
-    return None
+    return get_catalog().by_code.get(code)
+
+
+def find_quest_by_qr_key(qr_key: str):
+    """(zone, quest) for a quest QR key, or (None, None)."""
+    return get_catalog().by_qr_key.get(qr_key, (None, None))
@@ -0,0 +1,12 @@
+from services.logic import choose_best_quest, rank_quests
+
+
+def _quest(i):
+    return {"id": f"q{i}", "place": f"Place {i}", "type": "park", "indoor_outdoor": "outdoor",
+            "reward": "20 XP", "lat": 48.72, "lon": 21.26}
+
+
+def test_all_tied_keeps_input_order():
+    quests = [_quest(i) for i in range(6)]
+    assert choose_best_quest(quests)["id"] == "q0"
+    assert [q["id"] for _, q, _ in rank_quests(quests, k=3)] == ["q0", "q1", "q2"]
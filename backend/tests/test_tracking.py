@@ -0,0 +1,43 @@
+import math
+import random
+
+import pytest
+
+from services.tracking import TrackError, measure_batch, parse_ndjson
+
+LAT, LON = 48.72, 21.26
+M_PER_DEG = 111_195.0
+
+
+def _walk(fixes, batch=60):
+    """Feed fixes in batches like the app does; total metres."""
+    anchor, tail, total = None, (), 0.0
+    for i in range(0, len(fixes), batch):
+        metres, anchor, tail, _ = measure_batch(fixes[i:i + batch], anchor, tail)
+        total += metres
+    return total
+
+
+def _jitter(sigma, acc, seconds=3600, seed=1):
+    rng = random.Random(seed)
+    dlon = M_PER_DEG * math.cos(math.radians(LAT))
+    return [
+        (LAT + rng.gauss(0, sigma) / M_PER_DEG, LON + rng.gauss(0, sigma) / dlon, 1e6 + t, acc)
+        for t in range(seconds)
+    ]
+
+
+@pytest.mark.parametrize("sigma, acc", [(3, 0), (5, 5), (8, 8)])
+def test_an_hour_of_stationary_jitter_walks_about_zero(sigma, acc):
+    assert _walk(_jitter(sigma, acc)) < 30
+
+
+def test_a_straight_walk_is_counted():
+    dlon = M_PER_DEG * math.cos(math.radians(LAT))
+    fixes = [(LAT, LON + 1.4 * t / dlon, 1e6 + t, 5) for t in range(1200)]
+    assert _walk(fixes) == pytest.approx(1.4 * 1199, rel=0.05)
+
+
+def test_invalid_utf8_is_a_track_error():
+    with pytest.raises(TrackError):
+        parse_ndjson(b'{"lat": 48.7, "lon": 21.2, "t": 1}\n\xff\xfe')
@@ -6,4 +6,15 @@ def haversine(lat1, lon1, lat2, lon2):
     Δφ = math.radians(lat2 - lat1)
     Δλ = math.radians(lon2 - lon1)
     a = math.sin(Δφ/2)**2 + math.cos(φ1)*math.cos(φ2)*math.sin(Δλ/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
\ No newline at end of file
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def haversine_vec(lat1, lon1, lat2, lon2):
+    """Vectorized haversine in metres; arguments are numbers or arrays (broadcast)."""
+    import numpy as np
+
+    R = 6371e3
+    φ1, φ2 = np.radians(lat1), np.radians(lat2)
+    Δφ = φ2 - φ1
+    Δλ = np.radians(np.asarray(lon2, dtype=float) - np.asarray(lon1, dtype=float))
+    a = np.sin(Δφ/2)**2 + np.cos(φ1)*np.cos(φ2)*np.sin(Δλ/2)**2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
@@ -0,0 +1,68 @@
+import math
+
+METERS_PER_DEG_LAT = 111_195.0
+MAX_TILE_ZOOM = 22
+
+
+def tile_bbox(z, x, y):
+    """Slippy-map (Web Mercator) tile → (min_lat, min_lon, max_lat, max_lon)."""
+    if not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+class GridIndex:
+    """
+    Uniform lat/lon grid of `cell_deg` degrees. Items may carry a radius and
+    are then registered in every cell their circle touches, so a point query
+    only has to look at a single cell.
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self.cells = {}
+        self.items = {}
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _cells_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        r0, c0 = self._cell(min_lat, min_lon)
+        r1, c1 = self._cell(max_lat, max_lon)
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                yield (r, c)
+
+    def insert(self, item_id, lat, lon, radius_m=0.0, data=None):
+        self.items[item_id] = (lat, lon, radius_m, data)
+        dlat = radius_m / METERS_PER_DEG_LAT
+        dlon = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        for cell in self._cells_in_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+            self.cells.setdefault(cell, []).append(item_id)
+
+    def at(self, lat, lon):
+        """Ids whose circle may contain (lat, lon)."""
+        return self.cells.get(self._cell(lat, lon), ())
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Ids whose centre lies inside the bounding box."""
+        seen = set()
+        for cell in self._cells_in_bbox(min_lat, min_lon, max_lat, max_lon):
+            for item_id in self.cells.get(cell, ()):
+                if item_id in seen:
+                    continue
+                seen.add(item_id)
+                lat, lon = self.items[item_id][:2]
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                    yield item_id
+
+    def near(self, lat, lon, radius_m):
+        """Ids whose centre may lie within `radius_m` of (lat, lon) — candidates only."""
+        dlat = radius_m / METERS_PER_DEG_LAT
+        dlon = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        return self.in_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
@@ -0,0 +1,75 @@
+"""
+Quest payload shaping for slow mobile connections:
+  - FastJSONResponse: orjson serialization (also skips FastAPI's
+    jsonable_encoder pass when an endpoint returns it directly)
+  - ?fields=id,place,weather.temperature   sparse fieldsets (dotted paths)
+  - ?dedupe=true   identical weather blobs are sent once in a top-level
+                   "weather" map and quests carry a "weather_ref"
+"""
+import hashlib
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def parse_fields(fields):
+    """"id,weather.temperature" → {"id": True, "weather": {"temperature": True}}; None = everything."""
+    if not fields:
+        return None
+    tree = {}
+    for path in fields.split(","):
+        parts = [p for p in path.strip().split(".") if p]
+        if not parts:
+            continue
+        node = tree
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:  # parent already selected whole
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree or None
+
+
+def pick(obj, tree):
+    """Copy of `obj` restricted to the selected fields."""
+    if tree is None or not isinstance(obj, dict):
+        return obj
+    return {
+        key: obj[key] if sub is True else pick(obj[key], sub)
+        for key, sub in tree.items() if key in obj
+    }
+
+
+def weather_ref(weather):
+    return hashlib.sha1(orjson.dumps(weather, option=orjson.OPT_SORT_KEYS)).hexdigest()[:12]
+
+
+def shape_quests(quests, fields=None, dedupe=False):
+    """
+    Apply a sparse fieldset and optional weather de-duplication.
+    Returns (quests, weather_map or None). Input quests are never mutated.
+    """
+    tree = parse_fields(fields)
+    if tree is not None:
+        quests = [pick(q, tree) for q in quests]
+    if not dedupe:
+        return quests, None
+
+    blobs = {}
+    shaped = []
+    for quest in quests:
+        weather = quest.get("weather")
+        if isinstance(weather, dict):
+            ref = weather_ref(weather)
+            blobs.setdefault(ref, weather)
+            quest = {k: v for k, v in quest.items() if k != "weather"}
+            quest["weather_ref"] = ref
+        shaped.append(quest)
+    return shaped, blobs